@@ -0,0 +1,157 @@
+"""
+Reading and writing npz archives one array at a time.
+
+np.savez_compressed needs all arrays in memory at once. NpzWriter writes the same format
+(a zip file of .npy members), but an array can be written in pieces whose total shape is declared beforehand,
+so that a large output can be produced from inputs that are loaded one by one.
+
+Example:
+
+    with NpzWriter("out.npz") as npz:
+        npz.write("picsize", picsize)
+        with npz.stream("images_mean", np.uint8, (n, *item_shape)) as member:
+            for path in paths:
+                with np.load(path) as data:
+                    member.write(data["images_mean"])
+
+The members are compressed by a codec (see parse_codec), which is recorded in the zip container,
+so np.load reads the archive regardless of the codec.
+
+array_headers() reads the shapes and dtypes of the arrays in an npz without decompressing them.
+valid_length() is the number of states of a dataset archive that are used by merge-npz.py and sharded_dataset.py,
+and fields and optional_fields are the arrays that they concatenate along the states.
+"""
+
+import numpy as np
+import zipfile
+import argparse
+import contextlib
+
+codecs = {
+    "stored"  : zipfile.ZIP_STORED,
+    "deflate" : zipfile.ZIP_DEFLATED,
+    "bzip2"   : zipfile.ZIP_BZIP2,
+    "lzma"    : zipfile.ZIP_LZMA,
+}
+
+
+def parse_codec(string):
+    """Returns the zipfile compression method and level of a codec name:
+stored (no compression), deflate (the level of np.savez_compressed), deflate:1 ... deflate:9, bzip2, bzip2:1 ... bzip2:9, or lzma.
+This is also used as the type of the --codec options."""
+    name, _, level = string.partition(":")
+    if name not in codecs or (level and (name not in ("deflate", "bzip2") or level not in list("123456789"))):
+        raise ValueError("invalid codec: {}. Use stored, deflate, deflate:1-9, bzip2, bzip2:1-9 or lzma".format(string))
+    return codecs[name], (int(level) if level else None)
+
+
+def codec_type(string):
+    "A type for argparse which validates a codec name."
+    try:
+        parse_codec(string)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return string
+
+
+def savez(file, codec="deflate", **arrays):
+    "Same as np.savez_compressed, with a codec."
+    with NpzWriter(file, codec) as writer:
+        for name, array in arrays.items():
+            writer.write(name, array)
+
+
+class NpzWriter(object):
+
+    def __init__(self, file, codec="deflate"):
+        "file: a path or a writable, seekable file object."
+        compression, level = parse_codec(codec)
+        self.zip = zipfile.ZipFile(file, mode="w", compression=compression, compresslevel=level, allowZip64=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+
+    def write(self, name, array):
+        "Write an array in memory as name.npy."
+        array = np.asanyarray(array)
+        if array.ndim == 0:
+            array = array.reshape(1)
+            with self.stream(name, array.dtype, ()) as member:
+                member.write(array)
+        else:
+            with self.stream(name, array.dtype, array.shape) as member:
+                member.write(array)
+
+    @contextlib.contextmanager
+    def stream(self, name, dtype, shape):
+        """Write name.npy with the given dtype and shape, whose data is given by member.write() in C order,
+split along the first axis. An error is raised when the written data does not match the shape."""
+        header = {
+            "descr"         : np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order" : False,
+            "shape"         : tuple(shape),
+        }
+        # force_zip64 as in np.savez, since the size is not known to zipfile beforehand
+        with self.zip.open(name + ".npy", mode="w", force_zip64=True) as f:
+            np.lib.format.write_array_header_1_0(f, header)
+            # a scalar is written as a single item
+            member = _Member(f, np.dtype(dtype), tuple(shape) or (1,))
+            yield member
+            assert member.length == member.shape[0], \
+                "{}: {} items were written, expected {}".format(name, member.length, member.shape[0])
+
+
+class _Member(object):
+
+    def __init__(self, f, dtype, shape):
+        self.f      = f
+        self.dtype  = dtype
+        self.shape  = shape
+        self.length = 0
+
+    def write(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        assert array.shape[1:] == self.shape[1:], \
+            "expected an item shape {}, got {}".format(self.shape[1:], array.shape[1:])
+        assert self.length + len(array) <= self.shape[0], \
+            "more than {} items are written".format(self.shape[0])
+        self.f.write(memoryview(array).cast("B") if array.size else b"")
+        self.length += len(array)
+
+
+def array_headers(path):
+    "Returns a dict from the names of the arrays in an npz to their (shape, dtype), reading only the .npy headers."
+    headers = {}
+    with zipfile.ZipFile(path) as z:
+        for member in z.namelist():
+            if not member.endswith(".npy"):
+                continue
+            with z.open(member) as f:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            headers[member[:-len(".npy")]] = (shape, dtype)
+    return headers
+
+
+def valid_length(length):
+    """Returns the number of states of a dataset archive with the given length that form complete transitions.
+An odd length means the run was terminated prematurely, and the final state is discarded."""
+    return length - (length % 2)
+
+
+# the arrays of a dataset archive that are split along the states. merge-npz.py and sharded_dataset.py
+# concatenate them, and shift the state ids in transitions by the number of states in the preceding archives.
+# The other arrays are metadata, taken from the first archive.
+fields = ["images_mean", "images_var", "coords_mean", "coords_var", "transitions"]
+# the arrays split along the states that the archives of older versions lack.
+# They are concatenated only when all archives have them. The ids of the rendered transitions are not shifted.
+optional_fields = ["transition_ids"]
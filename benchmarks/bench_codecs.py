@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Compare the compression codecs of the dataset archives (see archive.parse_codec) in terms of
+the size of images_mean and images_var and the throughput of writing and reading them.
+
+By default, the arrays are extracted from a synthetic result directory (see make_fixture.py)
+at the patch shapes of generate-dataset.sh. Pass --npz to measure existing datasets instead.
+The throughput is in MB/s of the uncompressed arrays.
+
+Usage: ./benchmarks/bench_codecs.py [--npz DATASET.npz ...] [--codecs stored deflate:1 deflate lzma ...]
+"""
+
+import numpy as np
+import os
+import sys
+import argparse
+import subprocess
+import tempfile
+
+from harness import root, measure
+from archive import savez
+from make_fixture import make_fixture
+
+parser = argparse.ArgumentParser(description='benchmark the compression codecs of the dataset archives.')
+parser.add_argument('--npz', nargs="+", default=[],
+                    help="dataset archives to measure. By default, synthetic datasets are extracted.")
+parser.add_argument('--codecs', nargs="+",
+                    default=["stored", "deflate:1", "deflate:3", "deflate", "deflate:9", "bzip2", "lzma"])
+parser.add_argument('--num-transitions', default=100, type=int,
+                    help="the number of transitions of the synthetic datasets.")
+parser.add_argument('--repeat', default=3, type=int,
+                    help="the number of repetitions. The fastest one is reported.")
+
+# the outputs of generate-dataset.sh
+specs = {
+    "objs" : "resize=16x16",
+    "bgnd" : "resize=16x16,include-background",
+    "flat" : "resize=30x45,include-background,exclude-objects",
+    "high" : "resize=80x120,include-background,exclude-objects",
+}
+
+
+def synthetic(args, tmp):
+    dir = os.path.join(tmp, "fixture")
+    make_fixture(dir, args.num_transitions, num_samples_per_state=5, num_objects=3, size=(240, 360))
+    outs = [ os.path.join(tmp, name + ".npz") for name in specs ]
+    subprocess.run([sys.executable, os.path.join(root, "extract_all_regions_binary.py"),
+                    *[ arg for out, spec in zip(outs, specs.values()) for arg in ("--spec", "out={},{}".format(out, spec)) ],
+                    dir],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return outs
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        npzs = args.npz or synthetic(args, tmp)
+        print("{:<12} {:<10} {:>10} {:>8} {:>12} {:>12}".format("dataset", "codec", "size [MB]", "ratio", "write MB/s", "read MB/s"))
+        for npz in npzs:
+            with np.load(npz) as data:
+                arrays = { name : data[name] for name in ("images_mean", "images_var") }
+            nbytes = sum(array.nbytes for array in arrays.values()) / 2**20
+            name = os.path.splitext(os.path.basename(npz))[0]
+            shape = "x".join(map(str, arrays["images_mean"].shape[2:4]))
+            for codec in args.codecs:
+                out = os.path.join(tmp, "out.npz")
+                write, _ = measure(lambda: savez(out, codec, **arrays), args.repeat)
+                def read():
+                    with np.load(out) as data:
+                        for name in data.files:
+                            data[name]
+                read, _ = measure(read, args.repeat)
+                size = os.path.getsize(out) / 2**20
+                print("{:<12} {:<10} {:>10.2f} {:>8.2f} {:>12.1f} {:>12.1f}".format(
+                    name + "-" + shape, codec, size, nbytes / size, nbytes / write, nbytes / read))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
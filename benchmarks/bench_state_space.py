@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Measure the throughput and the peak memory of the exhaustive state enumeration (state_space.py)
+over the numbers of objects and the table sizes.
+
+By default all blocks are stackable cylinders (data/cylinders-properties.json), which gives the largest state spaces.
+
+Usage: ./benchmarks/bench_state_space.py [--num-objects 3 4 5 6] [--table-size 3 4 5] [-- state_space.py options...]
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+
+from harness import root, run, split_argv
+from archive import array_headers
+
+parser = argparse.ArgumentParser(description='benchmark the state space enumeration.')
+parser.add_argument('--num-objects', type=int, nargs="+", default=[3, 4, 5, 6])
+parser.add_argument('--table-size', type=int, nargs="+", default=[3, 4, 5])
+parser.add_argument('--properties-json', default=os.path.join(root, "data", "cylinders-properties.json"))
+
+
+def main(args, extra):
+    print("{:>8} {:>6} {:>12} {:>12} {:>10} {:>12} {:>10}".format(
+        "objects", "table", "states", "edges", "time [s]", "states/sec", "RSS [MB]"))
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "graph.npz")
+        for n in args.num_objects:
+            for t in args.table_size:
+                command = [sys.executable, os.path.join(root, "state_space.py"),
+                           "--num-objects", str(n), "--table-size", str(t), "--seed", "0",
+                           "--allow-duplicates", "--randomize-colors",
+                           "--properties-json", args.properties_json, "--out", out, *extra]
+                elapsed, rss = run(command, cwd=root)
+                headers = array_headers(out)
+                states, edges = headers["states"][0][0], headers["edges"][0][0]
+                print("{:>8} {:>6} {:>12} {:>12} {:>10.2f} {:>12.1f} {:>10.1f}".format(
+                    n, t, states, edges, elapsed, states / elapsed, rss / 2**20))
+
+
+if __name__ == '__main__':
+    argv, extra = split_argv()
+    main(parser.parse_args(argv), extra)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+Compare the throughput of the batched crop-and-resize of extract_all_regions_binary.py
+against calling skimage.transform.resize for each region, and report the largest difference.
+
+Usage: ./benchmarks/crop_resize.py [--images 50] [--objects 5] [--resize 16 16]
+"""
+
+import numpy as np
+import argparse
+import skimage.transform
+from skimage.util import img_as_ubyte
+
+from harness import measure
+from extract_all_regions_binary import crop_and_resize
+
+parser = argparse.ArgumentParser(description='benchmark the batched crop-and-resize.')
+parser.add_argument('--images', default=50, type=int, help="the number of images in a batch")
+parser.add_argument('--objects', default=5, type=int, help="the number of regions per image")
+parser.add_argument('--picsize', default=(100,150), type=int, nargs=2, metavar=("H","W"))
+parser.add_argument('--resize', type=int, nargs=2, action="append", metavar=("Y","X"),
+                    help="the patch size. This option can be given multiple times. default: 16x16, 30x45 and 80x120")
+parser.add_argument('--repeat', default=3, type=int)
+
+
+def loop(images, indices, boxes, shape):
+    results = np.zeros((len(boxes), *shape, 3), dtype=np.uint8)
+    for b, (i, (x1, y1, x2, y2)) in enumerate(zip(indices, boxes)):
+        region = images[i, int(y1):int(y2), int(x1):int(x2), :]
+        results[b] = img_as_ubyte(np.clip(skimage.transform.resize(region,(*shape,3)), 0.0, 1.0))
+    return results
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    H, W = args.picsize
+    # smooth images like renders, plus some noise
+    images = skimage.transform.resize(rng.random((args.images, H//10, W//10, 3)), (args.images, H, W, 3))
+    images = np.clip(images + rng.normal(0, 0.02, images.shape), 0.0, 1.0)
+    indices = np.repeat(np.arange(args.images), args.objects)
+    x1 = rng.integers(0, W-10, len(indices)).astype(float)
+    y1 = rng.integers(0, H-10, len(indices)).astype(float)
+    boxes = np.stack([x1, y1,
+                      np.minimum(W, x1 + rng.integers(5, W//3, len(indices))),
+                      np.minimum(H, y1 + rng.integers(5, H//3, len(indices)))], axis=1)
+
+    resizes = args.resize or [(16,16),(30,45),(80,120)]
+    print("{:>10} {:>10} {:>16} {:>16} {:>8} {:>9}".format("resize", "patches", "loop [p/sec]", "batched [p/sec]", "speedup", "max diff"))
+    for shape in resizes:
+        shape = tuple(shape)
+        t1, r1 = measure(loop, args.repeat, images, indices, boxes, shape)
+        t2, r2 = measure(crop_and_resize, args.repeat, images, indices, boxes, shape)
+        print("{:>10} {:>10} {:>16.1f} {:>16.1f} {:>8.2f} {:>9}".format(
+            "{}x{}".format(*shape), len(boxes), len(boxes) / t1, len(boxes) / t2, t1 / t2,
+            np.abs(r1.astype(int) - r2).max()))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
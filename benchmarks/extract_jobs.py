@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+"""
+Measure how the throughput of extract_all_regions_binary.py scales with --jobs,
+and check that every parallel run produces exactly the same arrays as the serial run.
+
+Usage: ./benchmarks/extract_jobs.py DIR [--jobs 1 2 4 8] [-- extraction options...]
+"""
+
+import numpy as np
+import os
+import sys
+import argparse
+import tempfile
+
+from harness import root, run, split_argv
+
+parser = argparse.ArgumentParser(description='benchmark the parallel region extraction.')
+parser.add_argument('dir', help="a result directory produced by render_images.py")
+parser.add_argument('--jobs', type=int, nargs="+", default=[1, 2, 4, os.cpu_count()],
+                    help="the numbers of worker processes to compare. The first one is the reference.")
+parser.add_argument('--num-samples-per-state', default=5, type=int)
+
+
+def extract(args, jobs, out, extra):
+    elapsed, _ = run([sys.executable, os.path.join(root, "extract_all_regions_binary.py"),
+                      "--num-samples-per-state", str(args.num_samples_per_state),
+                      "--jobs", str(jobs), "--out", out, *extra, args.dir])
+    return elapsed
+
+
+def main(args, extra):
+    files = [ f for f in os.listdir(os.path.join(args.dir, "scene_tr")) if "---" not in f ]
+    jobs = sorted(set(args.jobs), key=args.jobs.index)
+    with tempfile.TemporaryDirectory() as tmp:
+        # warm up the page cache. This also writes the distr_tr images, which the later runs skip
+        extract(args, jobs[0], os.path.join(tmp, "warmup.npz"), extra)
+        reference = None
+        print("{:>5} {:>10} {:>12} {:>8} {:>10}".format("jobs", "time [s]", "images/sec", "speedup", "identical"))
+        for n in jobs:
+            out = os.path.join(tmp, "{}.npz".format(n))
+            elapsed = extract(args, n, out, extra)
+            with np.load(out) as data:
+                arrays = { k: data[k] for k in data.files }
+            if reference is None:
+                reference = (elapsed, arrays)
+            identical = arrays.keys() == reference[1].keys() and \
+                all(np.array_equal(v, reference[1][k]) for k, v in arrays.items())
+            print("{:>5} {:>10.2f} {:>12.1f} {:>8.2f} {:>10}".format(
+                n, elapsed, len(files) / elapsed, reference[0] / elapsed, str(identical)))
+
+
+if __name__ == '__main__':
+    argv, extra = split_argv()
+    main(parser.parse_args(argv), extra)
@@ -0,0 +1,50 @@
+"""
+The helpers shared by the benchmarks: running a script in a child process while measuring its peak memory,
+timing a function, and splitting the options of the benchmark from those passed to the benchmarked script.
+
+Importing this module also makes the modules at the top of the repository importable.
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from profiling import maxrss_bytes
+
+
+def split_argv(argv=None):
+    """Returns the arguments before '--', which are the options of the benchmark,
+and those after it, which are passed to the benchmarked script."""
+    if argv is None:
+        argv = sys.argv[1:]
+    if '--' in argv:
+        idx = argv.index('--')
+        return argv[:idx], argv[idx+1:]
+    return argv, []
+
+
+def run(command, cwd=None):
+    "Run a command with its output discarded, and return the elapsed time and the peak RSS in bytes."
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=cwd)
+    # wait4 returns the resource usage of the child (and of its waited-for children, e.g., the workers of --jobs)
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    returncode = os.waitstatus_to_exitcode(status)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+    return elapsed, maxrss_bytes(rusage)
+
+
+def measure(fn, repeat, *args):
+    "Call fn(*args) repeat times, and return the fastest time and the result."
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, results
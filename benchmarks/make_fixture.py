@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Write a synthetic result directory in the format of render_images.py, without Blender,
+so that extract_all_regions_binary.py and merge-npz.py can be run and benchmarked anywhere.
+
+For each transition i and each state (pre, suc), it writes
+scene_tr/CLEVR_<i>_<pre|suc>_<j>.json and image_tr/CLEVR_<i>_<pre|suc>_<j>.png for the samples j,
+the base scenes scene_tr/CLEVR_<i>_<pre|suc>_---.json, and the manifest scene_tr.jsonl.
+Each state has a fixed set of colored boxes on a shaded floor; the samples jitter the boxes by a few pixels,
+like the wiggles of the renderer, and add a little noise, so that the images compress like the rendered ones.
+
+Usage: ./benchmarks/make_fixture.py DIR [--num-transitions 100] [--num-samples-per-state 5] [--num-objects 3] [--size 100 150]
+"""
+
+import numpy as np
+import json
+import os
+import argparse
+import imageio
+import tqdm
+
+parser = argparse.ArgumentParser(description='write a synthetic result directory for benchmarking the extraction.')
+parser.add_argument('dir', help="the output directory")
+parser.add_argument('--num-transitions', default=100, type=int)
+parser.add_argument('--num-samples-per-state', default=5, type=int)
+parser.add_argument('--num-objects', default=3, type=int)
+parser.add_argument('--size', default=(100, 150), type=int, nargs=2, metavar=("Y","X"),
+                    help="the height and the width of the images.")
+parser.add_argument('--start-idx', default=0, type=int,
+                    help="the index of the first transition. Use it to add transitions to an existing directory.")
+parser.add_argument('--seed', default=0, type=int)
+parser.add_argument('--no-manifest', action="store_true",
+                    help="do not write scene_tr.jsonl, as the renderer did before the manifest was introduced.")
+
+
+def path(dir, i, presuc, j, ext):
+    subdir = ext.replace("png", "image_tr").replace("json", "scene_tr")
+    if isinstance(j, int):
+        j = "{:03d}".format(j)
+    return os.path.join(dir, subdir, "CLEVR_{:06d}_{}_{}.{}".format(i, presuc, j, ext))
+
+
+def random_state(rng, num_objects, height, width):
+    "Returns the boxes (x1,y1,x2,y2) and the colors of the objects in a state."
+    sizes = rng.integers(max(height, width)//10, max(height, width)//4, (num_objects, 1))
+    x1 = rng.integers(0, width  - sizes)
+    y1 = rng.integers(0, height - sizes)
+    boxes = np.concatenate([x1, y1, x1+sizes, y1+sizes], axis=1)
+    colors = rng.integers(0, 256, (num_objects, 3))
+    return boxes, colors
+
+
+def render(rng, boxes, colors, height, width):
+    "Returns an RGBA image of the boxes, drawn in order, and the boxes jittered by a few pixels."
+    shade = np.linspace(96, 160, height, dtype=np.float64)[:, None, None]
+    image = np.broadcast_to(shade, (height, width, 3)).copy()
+    jittered = np.clip(boxes + rng.integers(-2, 3, (len(boxes), 1)), 0, [width, height, width, height])
+    for (x1, y1, x2, y2), color in zip(jittered, colors):
+        image[y1:y2, x1:x2] = color
+    image += rng.normal(0, 2, image.shape)
+    image = np.clip(image, 0, 255).astype(np.uint8)
+    alpha = np.full((height, width, 1), 255, dtype=np.uint8)
+    return np.concatenate([image, alpha], axis=2), jittered
+
+
+def make_fixture(dir, num_transitions, num_samples_per_state=5, num_objects=3, size=(100, 150),
+                 start_idx=0, seed=0, manifest=True):
+    height, width = size
+    os.makedirs(os.path.join(dir, "scene_tr"), exist_ok=True)
+    os.makedirs(os.path.join(dir, "image_tr"), exist_ok=True)
+    rng = np.random.default_rng((seed, start_idx))
+    with open(os.path.join(dir, "scene_tr.jsonl"), "a") if manifest else open(os.devnull, "w") as f:
+        for i in tqdm.trange(start_idx, start_idx+num_transitions):
+            for presuc in ("pre", "suc"):
+                boxes, colors = random_state(rng, num_objects, height, width)
+                with open(path(dir, i, presuc, "---", "json"), "w") as g:
+                    json.dump({"boxes": boxes.tolist(), "colors": colors.tolist()}, g)
+                for j in range(num_samples_per_state):
+                    image, jittered = render(rng, boxes, colors, height, width)
+                    imageio.imwrite(path(dir, i, presuc, j, "png"), image)
+                    scene = {
+                        "image_index"    : i,
+                        "image_filename" : os.path.basename(path(dir, i, presuc, j, "png")),
+                        "objects"        : [ { "color": color.tolist(), "bbox": [ float(v) for v in box ] }
+                                             for box, color in zip(jittered, colors) ],
+                    }
+                    with open(path(dir, i, presuc, j, "json"), "w") as g:
+                        json.dump(scene, g)
+                    f.write(json.dumps(scene) + "\n")
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    make_fixture(args.dir, args.num_transitions, args.num_samples_per_state, args.num_objects, args.size,
+                 args.start_idx, args.seed, not args.no_manifest)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+"""
+Compare the throughput of the batched preprocessing of extract_all_regions_binary.py
+against the per-image skimage implementation for each --preprocess-mode, and report the largest difference.
+
+Usage: ./benchmarks/preprocess.py [--images 50] [--modes 0 4 5 6]
+"""
+
+import numpy as np
+import argparse
+import skimage.transform
+from skimage.util import img_as_float
+
+from harness import measure
+from extract_all_regions_binary import preprocess, preprocess_batch
+
+parser = argparse.ArgumentParser(description='benchmark the batched preprocessing.')
+parser.add_argument('--images', default=50, type=int, help="the number of images in a batch")
+parser.add_argument('--picsize', default=(100,150), type=int, nargs=2, metavar=("H","W"))
+parser.add_argument('--modes', default=[0,1,2,3,4,5,6], type=int, nargs="+")
+parser.add_argument('--repeat', default=3, type=int)
+
+
+def loop(args, frames):
+    return np.stack([ preprocess(args, img_as_float(frame)) for frame in frames ])
+
+
+def main(args):
+    rng = np.random.default_rng(0)
+    H, W = args.picsize
+    # smooth images like renders, in a narrow range of intensities so that the rescaling has effects
+    frames = skimage.transform.resize(rng.random((args.images, H//10, W//10, 3)), (args.images, H, W, 3))
+    frames = (32 + 160 * frames + rng.normal(0, 4, frames.shape)).clip(0, 255).astype(np.uint8)
+
+    print("{:>5} {:>16} {:>16} {:>8} {:>10}".format("mode", "loop [img/sec]", "batched [img/sec]", "speedup", "max diff"))
+    for mode in args.modes:
+        options = argparse.Namespace(preprocess=True, preprocess_mode=mode)
+        t1, r1 = measure(loop, args.repeat, options, frames)
+        t2, r2 = measure(preprocess_batch, args.repeat, options, frames)
+        print("{:>5} {:>16.1f} {:>16.1f} {:>8.2f} {:>10.2e}".format(
+            mode, len(frames) / t1, len(frames) / t2, t1 / t2, np.abs(r1 - r2).max()))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
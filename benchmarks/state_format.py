@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+"""
+Compare the throughput of the state formats of blocks.py:
+the legacy format (State.dump / State.undump, written with indent=2 into a file per state, as the base scenes used to be)
+and the compact records (State.to_record / State.from_record, one line per state with save_states / load_states).
+
+Usage: ./benchmarks/state_format.py [--num-states 10000] [--num-objects 3 5 8]
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+
+from harness import root
+import blocks
+from blocks import State, Unstackable, load_colors, save_states, load_states
+
+parser = argparse.ArgumentParser(description='benchmark the state formats.')
+parser.add_argument('--num-states', default=10000, type=int)
+parser.add_argument('--num-objects', type=int, nargs="+", default=[3, 5, 8])
+parser.add_argument('--properties-json', default=os.path.join(root, "data", "cylinders-properties.json"))
+
+
+def random_states(num_states, num_objects, properties_json):
+    state_parser = argparse.ArgumentParser()
+    blocks.initialize_parser_input_options(state_parser)
+    blocks.initialize_parser_environment_options(state_parser)
+    args = state_parser.parse_args(["--num-objects", str(num_objects), "--table-size", str(num_objects),
+                                    "--randomize-colors", "--properties-json", properties_json])
+    load_colors(args)
+    random.seed(0)
+    states = []
+    while len(states) < num_states:
+        try:
+            state = State(args)
+            state.random_action()
+            states.append(state)
+        except Unstackable:
+            pass
+    return states
+
+
+def legacy(states, dir):
+    paths = [ os.path.join(dir, "{}.json".format(i)) for i in range(len(states)) ]
+    start = time.perf_counter()
+    for state, path in zip(states, paths):
+        with open(path, "w") as f:
+            json.dump(state.dump(), f, indent=2)
+    write = time.perf_counter() - start
+    start = time.perf_counter()
+    for path in paths:
+        with open(path, "r") as f:
+            State.undump(json.load(f))
+    read = time.perf_counter() - start
+    return write, read, sum(os.path.getsize(path) for path in paths)
+
+
+def compact(states, dir):
+    path = os.path.join(dir, "states.jsonl")
+    start = time.perf_counter()
+    save_states(path, states)
+    write = time.perf_counter() - start
+    start = time.perf_counter()
+    load_states(path)
+    read = time.perf_counter() - start
+    return write, read, os.path.getsize(path)
+
+
+def main(args):
+    print("{:>8} {:<8} {:>14} {:>14} {:>12}".format("objects", "format", "write states/s", "read states/s", "bytes/state"))
+    for n in args.num_objects:
+        states = random_states(args.num_states, n, args.properties_json)
+        for name, function in (("legacy", legacy), ("compact", compact)):
+            with tempfile.TemporaryDirectory() as dir:
+                write, read, size = function(states, dir)
+            print("{:>8} {:<8} {:>14.0f} {:>14.0f} {:>12.0f}".format(
+                n, name, len(states) / write, len(states) / read, size / len(states)))
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
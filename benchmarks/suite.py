@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Time extract_all_regions_binary.py and merge-npz.py on synthetic result directories of several sizes
+(see make_fixture.py), and report the throughput and the peak memory of each run.
+It needs neither Blender nor a GPU, so that regressions can be caught on a plain Linux box before a cluster run.
+
+For each size, it writes a fixture (or reuses the one in WORKDIR), extracts it in --parts runs
+of disjoint transition ranges as the cluster jobs do, and merges the resulting archives.
+The peak memory is the maximum resident set size of the child process, obtained by os.wait4.
+
+Usage: ./benchmarks/suite.py [--sizes 1000 10000 100000] [--workdir DIR] [--json REPORT] [-- extraction options...]
+"""
+
+import numpy as np
+import json
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+
+from harness import root, run, split_argv
+from make_fixture import make_fixture
+
+parser = argparse.ArgumentParser(description='benchmark the extraction and the merge on synthetic data.')
+parser.add_argument('--sizes', type=int, nargs="+", default=[1000, 10000, 100000],
+                    help="the numbers of images of the fixtures.")
+parser.add_argument('--num-samples-per-state', default=5, type=int)
+parser.add_argument('--num-objects', default=3, type=int)
+parser.add_argument('--size', default=(100, 150), type=int, nargs=2, metavar=("Y","X"),
+                    help="the height and the width of the images.")
+parser.add_argument('--parts', default=4, type=int,
+                    help="the number of extraction runs per fixture, i.e., the number of archives to merge.")
+parser.add_argument('--workdir', default=None,
+                    help="the directory to keep the fixtures in, so that later runs skip generating them. "
+                    +"By default, a temporary directory is used and removed at the end.")
+parser.add_argument('--json', default=None, metavar="REPORT",
+                    help="write the results to REPORT in JSON.")
+
+
+def fixture(args, workdir, images):
+    "Write a fixture with the given number of images unless it already exists, and return its directory."
+    transitions = max(1, images // (2 * args.num_samples_per_state))
+    dir = os.path.join(workdir, "fixture-{}-{}-{}-{}x{}".format(
+        transitions, args.num_samples_per_state, args.num_objects, *args.size))
+    done = os.path.join(dir, "done")
+    if not os.path.exists(done):
+        print("writing a fixture of {} images to {}".format(2 * transitions * args.num_samples_per_state, dir))
+        shutil.rmtree(dir, ignore_errors=True)
+        make_fixture(dir, transitions, args.num_samples_per_state, args.num_objects, args.size)
+        open(done, "w").close()
+    return dir, transitions
+
+
+def benchmark(args, workdir, images, extra):
+    dir, transitions = fixture(args, workdir, images)
+    images = 2 * transitions * args.num_samples_per_state
+    parts = min(args.parts, transitions)
+    bounds = np.linspace(0, transitions, parts+1).astype(int)
+    with tempfile.TemporaryDirectory() as tmp:
+        # each part extracts a copy of the directory restricted to its transitions, as a cluster job would
+        extract_time, extract_rss, outs = 0.0, 0, []
+        for k, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            part = os.path.join(tmp, "part{}".format(k))
+            for sub in ("scene_tr", "image_tr"):
+                os.makedirs(os.path.join(part, sub))
+                for f in os.listdir(os.path.join(dir, sub)):
+                    if start <= int(f.split("_")[1]) < stop:
+                        os.symlink(os.path.join(dir, sub, f), os.path.join(part, sub, f))
+            with open(os.path.join(dir, "scene_tr.jsonl")) as f, open(os.path.join(part, "scene_tr.jsonl"), "w") as g:
+                for line in f:
+                    if start <= json.loads(line)["image_index"] < stop:
+                        g.write(line)
+            out = os.path.join(tmp, "part{}.npz".format(k))
+            elapsed, rss = run([sys.executable, os.path.join(root, "extract_all_regions_binary.py"),
+                                "--num-samples-per-state", str(args.num_samples_per_state),
+                                "--out", out, *extra, part])
+            extract_time += elapsed
+            extract_rss = max(extract_rss, rss)
+            outs.append(out)
+
+        merged = os.path.join(tmp, "merged.npz")
+        merge_time, merge_rss = run([sys.executable, os.path.join(root, "merge-npz.py"), "--out", merged, *outs])
+        with np.load(merged) as data:
+            assert len(data["images_mean"]) == 2 * transitions, \
+                "the merged archive has {} states, expected {}".format(len(data["images_mean"]), 2 * transitions)
+        merged_bytes = os.path.getsize(merged)
+
+    return {
+        "images"                 : images,
+        "transitions"            : transitions,
+        "parts"                  : parts,
+        "extract_seconds"        : extract_time,
+        "extract_images_per_sec" : images / extract_time,
+        "extract_peak_rss"       : extract_rss,
+        "merge_seconds"          : merge_time,
+        "merge_states_per_sec"   : 2 * transitions / merge_time,
+        "merge_peak_rss"         : merge_rss,
+        "merged_bytes"           : merged_bytes,
+    }
+
+
+def main(args, extra):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="blocksworld-bench-")
+    results = []
+    try:
+        print("{:>8} {:>12} {:>12} {:>10} {:>12} {:>12} {:>10}".format(
+            "images", "extract [s]", "images/sec", "RSS [MB]", "merge [s]", "states/sec", "RSS [MB]"))
+        for images in args.sizes:
+            r = benchmark(args, workdir, images, extra)
+            results.append(r)
+            print("{:>8} {:>12.2f} {:>12.1f} {:>10.1f} {:>12.2f} {:>12.1f} {:>10.1f}".format(
+                r["images"], r["extract_seconds"], r["extract_images_per_sec"], r["extract_peak_rss"] / 2**20,
+                r["merge_seconds"], r["merge_states_per_sec"], r["merge_peak_rss"] / 2**20))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": vars(args), "extra": extra, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    argv, extra = split_argv()
+    main(parser.parse_args(argv), extra)
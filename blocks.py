@@ -1,5 +1,7 @@
 import json
 import random
+import hashlib
+import numpy as np
 from datetime import datetime as dt
 
 properties         = {}
@@ -115,13 +117,34 @@ def random_dict(dict):
   return random.choice(list(dict.items()))
 
 
+def unique_attributes(n):
+  """samples n distinct (color, size, material) triples, i.e., the attributes compared by Block.similar,
+uniformly without replacement from their product."""
+  colors    = list(dict.fromkeys(properties['colors']))
+  sizes     = list(dict.fromkeys(properties['sizes'].values()))
+  materials = list(dict.fromkeys(properties['materials'].values()))
+  total = len(colors) * len(sizes) * len(materials)
+  if n > total:
+    raise ValueError("{} objects without duplicates are requested, but there are only {} combinations of {} colors, {} sizes and {} materials. "
+                     "Use --allow-duplicates, or --randomize-colors to use all colors in the properties file."
+                     .format(n, total, len(colors), len(sizes), len(materials)))
+  res = []
+  for k in random.sample(range(total), n):
+    k, color    = divmod(k, len(colors))
+    k, size     = divmod(k, len(sizes))
+    material    = k
+    res.append((colors[color], sizes[size], materials[material]))
+  return res
+
+
 
 def dump(obj):
   def rec(obj):
-    if hasattr(obj, "__dict__"):
+    if hasattr(obj, "_vars") or hasattr(obj, "__dict__"):
+      # _vars, when defined, returns the attributes to be dumped
       res = {
         k : rec(v)
-        for k, v in vars(obj).items()
+        for k, v in (obj._vars() if hasattr(obj, "_vars") else vars(obj)).items()
       }
       res["__class__"] = obj.__class__.__name__
       return res
@@ -143,7 +166,11 @@ def undump(obj):
   def rec(obj):
     if isinstance(obj, dict):
       if "__class__" in obj:
-        cls = eval(obj["__class__"])
+        if obj["__class__"] not in classes:
+          raise ValueError("unknown class: {}".format(obj["__class__"]))
+        cls = classes[obj["__class__"]]
+        if hasattr(cls, "_from_vars"):
+          return cls._from_vars({ k: rec(v) for k,v in obj.items() if k != "__class__" })
         res = cls.__new__(cls)
         for k, v in obj.items():
           if k != "__class__":
@@ -163,40 +190,82 @@ class Unstackable(Exception):
 
 
 class Block(object):
-  def __init__(self,i):
+  # the attributes are fixed, which makes the blocks smaller and faster to copy than with __dict__
+  __slots__ = ("shape", "color", "size", "material", "rotation", "stackable", "_positions", "_i", "id")
+
+  def __init__(self,i,attributes=None):
+    "attributes is a (color, size, material) triple. By default, they are random."
     shape_name, self.shape = random_dict(properties['shapes'])
-    self.color             = random.choice(properties['colors'])
-    _, self.size           = random_dict(properties['sizes'])
-    _, self.material       = random_dict(properties['materials'])
+    if attributes is None:
+      attributes = (random.choice(properties['colors']),
+                    random_dict(properties['sizes'])[1],
+                    random_dict(properties['materials'])[1])
+    self.color, self.size, self.material = attributes
     self.rotation          = 360.0 * random.random()
     self.stackable         = properties['stackable'][shape_name] == 1
-    self.location          = [0,0,0]
+    # the location is stored in a row of an array, which is replaced by the positions of a State
+    # when the block is added to it. See State._attach.
+    self._positions        = np.zeros((1,3))
+    self._i                = 0
     self.id                = i
     pass
 
+  def _vars(self):
+    "returns the attributes in the order they had before the location was moved into an array."
+    res = { k : getattr(self, k) for k in ("shape", "color", "size", "material", "rotation", "stackable") }
+    res["location"] = self.location
+    res["id"]       = self.id
+    return res
+
+  @classmethod
+  def _from_vars(cls,attrs):
+    "the inverse of _vars, used by undump."
+    res = cls.__new__(cls)
+    res._positions = np.zeros((1,3))
+    res._i         = 0
+    for k, v in attrs.items():
+      setattr(res, k, v)
+    return res
+
+  def _copy(self,positions):
+    "returns a copy whose location is stored in the same row of positions."
+    res = Block.__new__(Block)
+    for k in Block.__slots__:
+      setattr(res, k, getattr(self, k))
+    res._positions = positions
+    return res
+
+  @property
+  def location(self):
+    return self._positions[self._i].tolist()
+
+  @location.setter
+  def location(self,newvalue):
+    self._positions[self._i] = newvalue
+
   @property
   def x(self):
-    return self.location[0]
+    return self._positions[self._i,0]
 
   @property
   def y(self):
-    return self.location[1]
+    return self._positions[self._i,1]
 
   @property
   def z(self):
-    return self.location[2]
+    return self._positions[self._i,2]
 
   @x.setter
   def x(self,newvalue):
-    self.location[0] = newvalue
+    self._positions[self._i,0] = newvalue
 
   @y.setter
   def y(self,newvalue):
-    self.location[1] = newvalue
+    self._positions[self._i,1] = newvalue
 
   @z.setter
   def z(self,newvalue):
-    self.location[2] = newvalue
+    self._positions[self._i,2] = newvalue
 
   def __eq__(o1,o2):
     if o1 is None:
@@ -226,126 +295,236 @@ class Block(object):
 
 
 class State(object):
-  "Randomly select a list of objects while avoiding duplicates"
+  """Randomly select a list of objects while avoiding duplicates.
+
+The locations, the sizes and the stackability of the objects are stored in arrays
+(positions, sizes, stackable), where the i-th row corresponds to self.objects[i],
+so that the queries on the objects (tops, objects_below, etc.) are vectorized.
+placed is a mask of the objects on the table; an object being moved by shuffle1 is not placed.
+
+The objects are placed in table_size columns, which are far enough apart that
+objects in different columns never overlap. shuffle1 maintains an index of the columns:
+column[i] is the column of the i-th object (-1 when it is not placed), and
+top[c] and heights[c] are the top object (-1 when empty) of the c-th column and the height of its top surface."""
+
+  # the array attributes, which are not part of the dumped format
+  arrays = ("positions", "sizes", "stackable", "placed", "column", "top", "heights")
 
   def __init__(self,args):
-    objects         = []
-    for i in range(args.num_objects):
-      while True:
-        o1 = Block(i)
-        if args.allow_duplicates:
-          break
-        ok = True
-        for o2 in objects:
-          if o1.similar(o2):
-            ok = False
-            print("duplicate object!")
-            break
-        if ok:
-          break
-      objects.append(o1)
+    if args.allow_duplicates:
+      objects = [ Block(i) for i in range(args.num_objects) ]
+    else:
+      objects = [ Block(i,attributes) for i, attributes in enumerate(unique_attributes(args.num_objects)) ]
 
     self.table_size = args.table_size
     self.object_jitter = args.object_jitter
     self.objects = objects
+    self._attach([ o.location for o in objects ])
     self.shuffle()
     pass
 
+  def _attach(self,locations):
+    """store the locations, the sizes and the stackability of the objects in arrays,
+and make each object refer to its row of the positions."""
+    n = len(self.objects)
+    self.positions = np.array(locations, dtype=float).reshape((n,3))
+    self.sizes     = np.array([ o.size for o in self.objects ], dtype=float)
+    self.stackable = np.array([ o.stackable for o in self.objects ], dtype=bool)
+    self.placed    = np.ones(n, dtype=bool)
+    for i, o in enumerate(self.objects):
+      o._positions = self.positions
+      o._i         = i
+    self._index_columns()
+
+  def _column_x(self,c):
+    unit = max(properties['sizes'].values())
+    max_x = unit * 2 * self.table_size
+    return max_x * ((c / (self.table_size-1)) - 1/2)
+
+  def _index_columns(self):
+    """build the column index from the positions."""
+    c0, c1 = self._column_x(0), self._column_x(1)
+    self.column  = np.clip(np.rint((self.positions[:,0] - c0) / (c1 - c0)), 0, self.table_size-1).astype(int)
+    self.column[~self.placed] = -1
+    self.top     = np.full(self.table_size, -1)
+    self.heights = np.zeros(self.table_size)
+    # from the bottom to the top
+    for i in np.argsort(self.positions[:,2], kind="stable"):
+      if self.placed[i]:
+        self.top[self.column[i]]     = i
+        self.heights[self.column[i]] = self.positions[i,2] + self.sizes[i]
+
+  def _lift(self,i):
+    """remove the i-th object, which must be at the top of its column, from the column index."""
+    c = self.column[i]
+    assert self.top[c] == i, "only the top object of a column can be moved"
+    z = self.positions[:,2]
+    rest = (self.column == c)
+    rest[i] = False
+    if rest.any():
+      j = np.flatnonzero(rest)[np.argmax(z[rest])]
+      self.top[c], self.heights[c] = j, z[j] + self.sizes[j]
+    else:
+      self.top[c], self.heights[c] = -1, 0.0
+    self.column[i] = -1
+
+  def _vars(self):
+    return { k : v for k, v in vars(self).items() if k not in State.arrays }
+
   def for_rendering(self):
-    return [ vars(o) for o in sorted(self.objects, key=(lambda o: o.id)) ]
+    return [ o._vars() for o in sorted(self.objects, key=(lambda o: o.id)) ]
 
   def dump(self):
     return dump(self)
 
   @staticmethod
   def undump(data):
-    return undump(data)
+    state = undump(data)
+    state._attach([ o.location for o in state.objects ])
+    return state
+
+  # the attributes of the blocks in a record, in this order
+  record_fields = ("shape", "color", "size", "material", "rotation", "stackable", "location", "id")
+
+  def to_record(self):
+    """returns the state as a compact dict, which stores each attribute of the blocks in a list.
+Unlike dump, it does not store the class names, and it is read by from_record without the generic recursion."""
+    record = { k : v for k, v in self._vars().items() if k != "objects" }
+    record["blocks"] = { k : [ getattr(o, k) for o in self.objects ] for k in State.record_fields if k != "location" }
+    record["blocks"]["location"] = self.positions.tolist()
+    return record
+
+  @staticmethod
+  def from_record(record):
+    "the inverse of to_record."
+    state = State.__new__(State)
+    for k, v in record.items():
+      if k != "blocks":
+        setattr(state, k, v)
+    columns = record["blocks"]
+    state.objects = []
+    for values in zip(*(columns[k] for k in State.record_fields if k != "location")):
+      o = Block.__new__(Block)
+      o.shape, o.color, o.size, o.material, o.rotation, o.stackable, o.id = values
+      o.color = tuple(o.color)
+      state.objects.append(o)
+    state._attach(columns["location"])
+    return state
+
+  @staticmethod
+  def load(data):
+    "reads a state either from a record (to_record) or from the legacy format (dump)."
+    if "blocks" in data:
+      return State.from_record(data)
+    return State.undump(data)
+
+  def clone(self):
+    """returns a copy of the state. It is much faster than copy.deepcopy,
+as it copies the arrays and the blocks without the generic recursion."""
+    res = State.__new__(State)
+    res.__dict__.update(self.__dict__)
+    for k in State.arrays:
+      setattr(res, k, getattr(self, k).copy())
+    res.objects = [ o._copy(res.positions) for o in self.objects ]
+    return res
+
+  def __deepcopy__(self,memo):
+    return self.clone()
 
   def shuffle(self):
     """destructively modify the list of objects using shuffle1."""
-    objs = self.objects.copy()
-    self.objects.clear()
-    for oi in objs:
+    self.placed[:] = False
+    self._index_columns()
+    for i, oi in enumerate(self.objects):
       self.shuffle1(oi)
-      self.objects.append(oi)
+      self.placed[i] = True
 
   def shuffle1(self,oi,force_change=False):
-    """destructively modify an object by choosing a random x position and put it on top of existing objects.
- oi itself is not inserted to the list of objects."""
-    # note: if a cube is rotated by 45degree, it should consume 1.41 times the size
-    unit = max(properties['sizes'].values())
-    max_x = unit * 2 * self.table_size
-
+    """destructively modify an object by choosing a random column and put it on top of the objects in the column.
+ oi itself should not be placed, i.e., it is ignored as an obstacle.
+ The column is chosen uniformly from the feasible ones, i.e., those whose top object is stackable or which are empty.
+ When force_change is true, the column must also change the object just below oi.
+ Unstackable is raised only when no column is feasible."""
     if force_change:
       object_below = self.object_just_below(oi)
+      object_below = -1 if object_below is None else object_below._i
+
+    i = oi._i
+    if self.column[i] >= 0:
+      self._lift(i)
 
-    trial = 0
-    fail = True
-    while fail and trial < 100:
-      fail = False
-      oi.x = max_x * ((random.randint(0,self.table_size-1) / (self.table_size-1)) - 1/2)
-      oi.z = 0
-      for oj in self.objects:
-        if oi.overlap(oj):
-          if not oj.stackable:
-            fail = True
-            break
-          if not oi.stable_on(oj):
-            fail = True
-            break
-          oi.z = max(oi.z, oj.z + oj.size)
-      oi.z += oi.size
-      if force_change:
-        new_object_below = self.object_just_below(oi)
-        if object_below == new_object_below:
-          # is not shuffled!
-          fail = True
-      trial += 1
-
-    if fail:
+    feasible = (self.top < 0) | self.stackable[self.top]
+    if force_change:
+      # placing it on the same object (or on the table when it was on the table) does not change the state
+      feasible &= (self.top != object_below)
+    candidates = np.flatnonzero(feasible).tolist()
+    if len(candidates) == 0:
       raise Unstackable("this state is not stackable")
-    pass
 
+    c = random.choice(candidates)
+    oi.x = self._column_x(c)
+    oi.z = self.heights[c] + self.sizes[i]
+    self.column[i]  = c
+    self.top[c]     = i
+    self.heights[c] = oi.z + self.sizes[i]
+
+
+  def fingerprint(self):
+    """returns a canonical hash of the logical state, i.e., the attributes of the blocks in each column
+from the bottom to the top. It ignores the jitter, the rotations and the order of the objects."""
+    columns = [ [] for _ in range(self.table_size) ]
+    for i in np.lexsort((self.positions[:,2], self.column)):
+      if self.column[i] >= 0:
+        o = self.objects[i]
+        columns[self.column[i]].append((o.shape, o.color, o.size, o.material))
+    return hashlib.blake2b(json.dumps(columns).encode(), digest_size=16).hexdigest()
 
   def wiggle(self):
     """wiggles all objects by adding a jitter to the x coordinate of the objects"""
     unit = max(properties['sizes'].values())
-    for oi in self.objects:
-      oi.x += random.gauss(0.0, self.object_jitter * unit)
+    self.positions[:,0] += [ random.gauss(0.0, self.object_jitter * unit) for _ in self.objects ]
 
+  def wiggles(self,n):
+    """returns n lists of objects for rendering, each wiggled as by wiggle(), without modifying or copying the state.
+The jitters are drawn in the same order as calling clone(), wiggle() and for_rendering() n times."""
+    unit = max(properties['sizes'].values())
+    jitter = np.array([ random.gauss(0.0, self.object_jitter * unit) for _ in range(n * len(self.objects)) ])
+    xs = (self.positions[:,0] + jitter.reshape((n, len(self.objects)))).tolist()
+    order = sorted(range(len(self.objects)), key=(lambda i: self.objects[i].id))
+    results = []
+    for x in xs:
+      objects = []
+      for i in order:
+        o = self.objects[i]._vars()
+        o["location"][0] = x[i]
+        objects.append(o)
+      results.append(objects)
+    return results
+
+
+  def _above(self,i):
+    """returns a mask of the placed objects below the i-th object, i.e., overlapping and lower."""
+    x, z = self.positions[:,0], self.positions[:,2]
+    return self.placed & (np.abs(x[i] - x) < (self.sizes[i] + self.sizes)) & (z[i] > z)
 
   def tops(self):
     """returns a list of objects on which nothing is on top of, i.e., it is the top object of the tower."""
-    tops = []
-    for o1 in self.objects:
-      top = True
-      for o2 in self.objects:
-        if o1 == o2:
-          continue
-        if o2.above(o1):
-          top = False
-          break
-      if top:
-        tops.append(o1)
-    return tops
+    x, z = self.positions[:,0], self.positions[:,2]
+    # above[i,j] : the i-th object is above the j-th object
+    above = (np.abs(x[:,None] - x[None,:]) < (self.sizes[:,None] + self.sizes[None,:])) & (z[:,None] > z[None,:])
+    covered = np.any(above & self.placed[:,None], axis=0)
+    return [ o for o, top in zip(self.objects, self.placed & ~covered) if top ]
 
   def objects_below(self,o):
-    results = []
-    for other in self.objects:
-      if o != other and o.above(other):
-        results.append(other)
-    return results
+    return [ self.objects[j] for j in self._above(o._i).nonzero()[0] ]
 
   def object_just_below(self,o):
-    objects_below = self.objects_below(o)
-    if len(objects_below) == 0:
+    below = self._above(o._i).nonzero()[0]
+    if len(below) == 0:
       return None
     else:
-      result = objects_below[0]
-      for other in objects_below[1:]:
-        if result.z < other.z:
-          result = other
-      return result
+      # the first one among the highest objects
+      return self.objects[below[np.argmax(self.positions[below,2])]]
 
   def random_action(self):
     method = random.choice([self.action_move])
@@ -354,13 +533,28 @@ class State(object):
     self.last_action = method.__name__
     pass
 
+  def movable(self,o):
+    """returns True when o, a top object, can be moved by action_move, i.e., shuffle1(o,force_change=True)
+has a feasible column. It is computed from the column index without modifying the state:
+another column whose top object is stackable, or an empty column unless o is on the table."""
+    c = self.column[o._i]
+    others = (np.arange(self.table_size) != c)
+    stackable_top = (self.top >= 0) & self.stackable[np.maximum(self.top, 0)]
+    on_table = np.count_nonzero(self.column == c) == 1
+    return bool(np.any(others & stackable_top) or (not on_table and np.any(self.top < 0)))
+
   def action_move(self):
-    o = random.choice(self.tops())
-    index = self.objects.index(o)
-    self.objects.remove(o)
-    self.shuffle1(o,force_change=True)
-    self.objects.insert(index,o)
+    """moves a top object to another column, so that the state changes.
+The object is chosen uniformly from the top objects that can move (see movable), and
+Unstackable is raised only when none of them can."""
+    candidates = [ o for o in self.tops() if self.movable(o) ]
+    if len(candidates) == 0:
+      raise Unstackable("no object can be moved")
+    o = random.choice(candidates)
     # note: do not change the order of the object.
+    self.placed[o._i] = False
+    self.shuffle1(o,force_change=True)
+    self.placed[o._i] = True
     pass
 
   def action_change_material(self):
@@ -370,3 +564,21 @@ class State(object):
     o.material = random.choice(tmp)
     pass
 
+
+
+# the classes that undump may instantiate
+classes = { "State" : State, "Block" : Block }
+
+
+def save_states(path, states):
+  """writes the states into a file, one compact JSON record (State.to_record) per line."""
+  with open(path, "w") as f:
+    for state in states:
+      f.write(json.dumps(state.to_record(), separators=(",",":")))
+      f.write("\n")
+
+
+def load_states(path):
+  """reads the states written by save_states."""
+  with open(path, "r") as f:
+    return [ State.from_record(json.loads(line)) for line in f if line.strip() ]
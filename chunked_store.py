@@ -0,0 +1,156 @@
+"""
+A directory of fixed-size chunks of .npy files, an alternative to a single npz archive.
+
+Layout:
+
+    path/index.json               --- the number of items, the chunk size, the fields and the metadata
+    path/<field>/<chunk>.npy      --- items [chunk*chunk_size, (chunk+1)*chunk_size) of a field
+
+Every field is split along the first axis. The chunk files are raw (uncompressed) .npy files allocated
+at their full size, so that the store can be appended to, and can be read with np.load(mmap_mode='r'),
+where accessing an item touches only the pages it occupies.
+The index is rewritten atomically after the data is written, so that a reader never sees an item
+that is not fully written.
+
+Example:
+
+    store = ChunkedStore.create("out", chunk_size=1024, metadata={"picsize":[100,150,3]})
+    store.append(images_mean=..., transitions=...)
+    ...
+    store = ChunkedStore("out")
+    store["images_mean"][5]     # -> ndarray, read from a memory map
+    store["images_mean"][5:10]
+    store.metadata["picsize"]
+"""
+
+import numpy as np
+import json
+import os
+import shutil
+
+from views import RowView
+
+
+class ChunkedStore(object):
+
+    def __init__(self, path):
+        "Open an existing store."
+        self.path = path
+        with open(os.path.join(path, "index.json"), "r") as f:
+            index = json.load(f)
+        self.length     = index["length"]
+        self.chunk_size = index["chunk_size"]
+        self.fields     = { name : (np.dtype(dtype), tuple(shape)) for name, (dtype, shape) in index["fields"].items() }
+        self.metadata   = index["metadata"]
+        self._chunks    = {}
+
+    @classmethod
+    def create(cls, path, chunk_size=1024, metadata={}):
+        "Create an empty store. An existing store in the same directory is removed."
+        if os.path.exists(os.path.join(path, "index.json")):
+            for name in ChunkedStore(path).fields:
+                shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+        elif os.path.isdir(path) and os.listdir(path):
+            raise FileExistsError("{} exists and is not a chunked store".format(path))
+        os.makedirs(path, exist_ok=True)
+        store = cls.__new__(cls)
+        store.path       = path
+        store.length     = 0
+        store.chunk_size = chunk_size
+        store.fields     = {}
+        store.metadata   = { k : np.asarray(v).tolist() for k, v in metadata.items() }
+        store._chunks    = {}
+        store._write_index()
+        return store
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        if name in self.fields:
+            return ChunkedArray(self, name)
+        return np.asarray(self.metadata[name])
+
+    def __contains__(self, name):
+        return name in self.fields or name in self.metadata
+
+    def _chunk_path(self, name, chunk):
+        return os.path.join(self.path, name, "{:06d}.npy".format(chunk))
+
+    def _chunk(self, name, chunk, mode="r"):
+        key = (name, chunk, mode)
+        if key not in self._chunks:
+            if mode == "r":
+                self._chunks[key] = np.load(self._chunk_path(name, chunk), mmap_mode="r")
+            elif os.path.exists(self._chunk_path(name, chunk)):
+                self._chunks[key] = np.load(self._chunk_path(name, chunk), mmap_mode="r+")
+            else:
+                dtype, shape = self.fields[name]
+                os.makedirs(os.path.join(self.path, name), exist_ok=True)
+                self._chunks[key] = np.lib.format.open_memmap(self._chunk_path(name, chunk), mode="w+",
+                                                               dtype=dtype, shape=(self.chunk_size, *shape))
+        return self._chunks[key]
+
+    def append(self, **arrays):
+        """Append the items in the arrays, which must have the same length.
+The fields are created by the first call; later calls must provide the same fields."""
+        lengths = set(len(array) for array in arrays.values())
+        assert len(lengths) == 1, "the arrays have different lengths: {}".format(lengths)
+        n = lengths.pop()
+        if not self.fields:
+            self.fields = { name : (np.asarray(array).dtype, np.shape(array)[1:]) for name, array in arrays.items() }
+        assert arrays.keys() == self.fields.keys(), \
+            "expected fields {}, got {}".format(sorted(self.fields), sorted(arrays))
+
+        for name, array in arrays.items():
+            dtype, shape = self.fields[name]
+            assert np.shape(array)[1:] == shape, "{}: expected an item shape {}, got {}".format(name, shape, np.shape(array)[1:])
+            i = self.length
+            while i < self.length + n:
+                chunk, offset = divmod(i, self.chunk_size)
+                size = min(self.chunk_size - offset, self.length + n - i)
+                self._chunk(name, chunk, "r+")[offset:offset+size] = array[i-self.length:i-self.length+size]
+                i += size
+
+        for key, chunk in list(self._chunks.items()):
+            if key[2] == "r+":
+                chunk.flush()
+        # the index is updated only after the data is on the disk.
+        self.length += n
+        self._write_index()
+
+    def _write_index(self):
+        index = {
+            "length"     : self.length,
+            "chunk_size" : self.chunk_size,
+            "fields"     : { name : (dtype.str, shape) for name, (dtype, shape) in self.fields.items() },
+            "metadata"   : self.metadata,
+        }
+        tmp = os.path.join(self.path, "index.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self.path, "index.json"))
+
+
+class ChunkedArray(RowView):
+    "A read-only view of a field in a ChunkedStore. See views.RowView for the supported indexing."
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name  = name
+        self.dtype, item_shape = store.fields[name]
+        self.shape = (len(store), *item_shape)
+
+    def _rows(self, start, stop):
+        size = self.store.chunk_size
+        first, last = start // size, (stop - 1) // size
+        if first == last:
+            # a view of a single chunk does not copy the data
+            return self.store._chunk(self.name, first)[start - first*size:stop - first*size]
+        return np.concatenate([
+            self.store._chunk(self.name, chunk)[max(start, chunk*size) - chunk*size:min(stop, (chunk+1)*size) - chunk*size]
+            for chunk in range(first, last+1) ])
+
+    def _row(self, i):
+        chunk, offset = divmod(i, self.store.chunk_size)
+        return self.store._chunk(self.name, chunk)[offset]
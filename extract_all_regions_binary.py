@@ -10,11 +10,51 @@ import skimage.color
 from skimage.util import img_as_float, img_as_ubyte
 import argparse
 import tqdm
+import multiprocessing
+from chunked_store import ChunkedStore
+from frame_cache import FrameCache
+from profiling import Profile
+from archive import savez, codec_type, NpzWriter, array_headers
+
+
+def parse_spec(string):
+    spec = {}
+    for item in string.split(","):
+        key, _, value = item.partition("=")
+        if key == "out" and value:
+            spec["out"] = value
+        elif key == "resize" and value:
+            try:
+                spec["resize"] = tuple(int(v) for v in value.split("x"))
+            except ValueError:
+                raise argparse.ArgumentTypeError("invalid resize value: {}".format(value))
+            if len(spec["resize"]) != 2:
+                raise argparse.ArgumentTypeError("invalid resize value: {}".format(value))
+        elif key == "format" and value in ("npz", "chunked"):
+            spec["format"] = value
+        elif key == "codec" and value:
+            spec["codec"] = codec_type(value)
+        elif key in ("include-background", "exclude-objects", "as-problem") and not value:
+            spec[key.replace("-","_")] = True
+        else:
+            raise argparse.ArgumentTypeError("invalid output specification: {}".format(item))
+    return spec
+
+
+def parse_size(string):
+    units = {"K":2**10, "M":2**20, "G":2**30, "T":2**40}
+    try:
+        if string[-1].upper() in units:
+            return int(float(string[:-1]) * units[string[-1].upper()])
+        return int(string)
+    except (ValueError, IndexError):
+        raise argparse.ArgumentTypeError("invalid memory size: {}".format(string))
+
 
 parser = argparse.ArgumentParser(
     description='extract the regions and save the results in a npz file.')
 parser.add_argument('dir')
-parser.add_argument('--out', type=argparse.FileType('wb'), default='regions.npz')
+parser.add_argument('--out', default='regions.npz')
 parser.add_argument('--resize', type=int, default=(32,32), nargs=2, metavar=("Y","X"),
                     help="the size of the image patch resized from the region originally extracted")
 parser.add_argument('--exclude-objects', action='store_true',
@@ -23,12 +63,73 @@ parser.add_argument('--include-background', action='store_true',
                     help="include the whole image as a global object. The object is inserted at the end.")
 parser.add_argument('--as-problem', action='store_true',
                     help="Store the data into 'init' and 'goal' fields used by the planner instead of the usual set of fields in the archive.")
+parser.add_argument('--spec', action='append', default=[], type=parse_spec, metavar="KEY=VALUE,...",
+                    help="Specify an output of the extraction. This option can be given multiple times, "
+                    +"and each image is decoded only once for all outputs. "
+                    +"The value is a comma-separated list of out=PATH, resize=YxX, format=npz|chunked, codec=CODEC, and the flags include-background, exclude-objects, as-problem, "
+                    +"e.g., --spec out=bgnd.npz,resize=16x16,include-background . "
+                    +"Unspecified values default to the corresponding command line options. "
+                    +"When no --spec is given, the output is specified by --out, --resize, --format, --codec, --include-background, --exclude-objects and --as-problem.")
+parser.add_argument('--format', default="npz", choices=("npz", "chunked"),
+                    help="The format of the output. npz: a single compressed npz archive. "
+                    +"chunked: a directory of fixed-size chunks of uncompressed npy files (see chunked_store.py), "
+                    +"which is written as the extraction progresses and can be read through memory maps. "
+                    +"The chunked format does not support --as-problem.")
+parser.add_argument('--codec', type=codec_type, default="deflate",
+                    help="The compression of the npz output: stored, deflate, deflate:1-9, bzip2, bzip2:1-9 or lzma. "
+                    +"The default is the same as np.savez_compressed. "
+                    +"The codec is recorded in the archive, and np.load reads any of them. "
+                    +"Faster codecs (stored, deflate:1) make larger files that load faster; "
+                    +"see benchmarks/bench_codecs.py. Ignored by the chunked format, which is not compressed.")
+parser.add_argument('--preprocess-method', default="batched", choices=("batched", "skimage"),
+                    help="How the images are preprocessed. skimage: call the skimage functions for each image in float64. "
+                    +"batched: preprocess the uint8 images of a state at once in float32, using lookup tables where possible. "
+                    +"Modes 4, 5 and 6 have the batched implementations, and the others fall back to skimage. "
+                    +"Without preprocessing (mode 0), both methods give the same float64 images.")
+parser.add_argument('--resize-method', default="batched", choices=("batched", "skimage"),
+                    help="How the regions are resized. skimage: call skimage.transform.resize for each region. "
+                    +"batched: resize all regions of the samples of a state at once with a few matrix products, "
+                    +"which is faster and differs from skimage by at most 1 in the uint8 result.")
+parser.add_argument('--frame-cache', action='store_true',
+                    help="Cache the decoded frames in DIR/frames.npy, and read the frames from the cache in the later runs "
+                    +"instead of decoding the PNG files. The cache is rebuilt when the images are added, removed or modified. "
+                    +"It is ignored with --incremental, whose runs read different images each time.")
+parser.add_argument('--incremental', action='store_true',
+                    help="Append to the existing outputs instead of overwriting them. "
+                    +"Only the transitions that are not yet in the outputs and whose samples are all rendered are extracted. "
+                    +"This allows extracting the results while the rendering is still running. "
+                    +"The outputs must have been produced by the same version of this script. Not compatible with --as-problem. "
+                    +"An npz output is rewritten in each run, streaming its existing arrays one at a time into the new archive, "
+                    +"thus each run takes time proportional to the whole output. "
+                    +"The chunked format (--format chunked) only appends the new states to its chunk files, "
+                    +"which makes it the better choice when the extraction is repeated many times.")
+parser.add_argument('--no-manifest', action='store_true',
+                    help="Read the scenes from the files in DIR/scene_tr/ even when DIR/scene_tr.jsonl, "
+                    +"the manifest written by render_images.py, exists. "
+                    +"Use this for a directory where some scenes were rendered by an older version without the manifest.")
+parser.add_argument('--profile', nargs='?', const="profile.json", default=None, metavar="REPORT",
+                    help="Measure the time, the number of items and the bytes processed in each stage of the extraction, "
+                    +"as well as the peak RSS. A summary table is printed at the end, and the report is written to REPORT "
+                    +"in JSON (default: profile.json).")
+parser.add_argument('--store-chunk-size', default=1024, type=int,
+                    help="The number of states in a chunk file of the chunked format.")
 parser.add_argument('--preprocess', action='store_true',
                     help="Normalize the image using histogram normalization (images are converted to ycbcr, y channel is normalzied, then put back to rgb.")
 parser.add_argument('--preprocess-mode', type=int, default=6,
                     help="")
 parser.add_argument('--num-samples-per-state', default=5, type=int,
                     help="The number of images to render per logical states")
+parser.add_argument('--jobs', default=1, type=int,
+                    help="The number of worker processes. The states are split into contiguous chunks, "
+                    +"and each worker writes its results directly into the output buffers shared among the processes. "
+                    +"The result is identical to the serial extraction (--jobs 1).")
+parser.add_argument('--max-memory', default="1G", type=parse_size, metavar="BYTES",
+                    help="The memory budget of the extraction, e.g., 512M, 4G. "
+                    +"The means and the variances are accumulated over a chunk of states at a time, "
+                    +"and the number of states in a chunk is chosen so that the output arrays, and "
+                    +"the accumulators and the image buffers of all workers fit in this budget. "
+                    +"A warning is printed when the buffers for a single state exceed it. "
+                    +"The budget does not include the memory of the interpreter and the libraries.")
 
 
 def preprocess(args,rgb):
@@ -46,7 +147,7 @@ def preprocess(args,rgb):
     elif mode == 3:
         return skimage.exposure.equalize_adapthist(rgb)
     elif mode == 4:
-        return skimage.exposure.rescale_intensity(im)
+        return skimage.exposure.rescale_intensity(rgb)
     elif mode == 5:
         hsv = skimage.color.rgb2hsv(rgb)
         hsv[:,:,1] = skimage.exposure.rescale_intensity(hsv[:,:,1])
@@ -59,6 +160,71 @@ def preprocess(args,rgb):
 
 
 
+def rescale_lut(lo, hi):
+    """Per-image lookup tables that map the uint8 values v to the float values rescale_intensity(v/255) would return,
+where lo and hi are the minimum and maximum values of each image."""
+    lo = lo.astype(np.float32)[:,None]
+    hi = hi.astype(np.float32)[:,None]
+    values = np.arange(256, dtype=np.float32)[None,:]
+    # a constant image is returned as it is
+    return np.where(hi > lo, (values - lo) / np.maximum(hi - lo, 1), values / 255)
+
+
+def preprocess_batch(args,frames):
+    """Batched version of preprocess for a stack of uint8 images of shape (N,H,W,3).
+Returns the float32 images in [0,1], except that mode 0 (no preprocessing) returns the float64 images
+of img_as_float, which preprocess returns, so that --resize-method skimage gives the same results
+regardless of --preprocess-method."""
+    if not args.preprocess:
+        args.preprocess_mode = 0
+    mode = args.preprocess_mode
+    N = len(frames)
+    n = np.arange(N)[:,None,None]
+    if mode == 0:
+        return img_as_float(frames)
+    elif mode == 4:
+        lut = rescale_lut(frames.min(axis=(1,2,3)), frames.max(axis=(1,2,3)))
+        return lut[n[...,None], frames]
+    elif mode in (5, 6):
+        # Instead of converting to HSV and back, this uses the fact that each channel c of an RGB pixel is
+        # V * (1 - S * w), where V = max, S = (max-min) / max, and w = (max - c) / (max - min) depends only on the hue.
+        # Rescaling S and V keeps w unchanged, thus the result is V' * (1 - S' * w).
+        v = frames.max(axis=-1)
+        delta = v - frames.min(axis=-1)
+        if mode == 6:
+            vlut = rescale_lut(v.min(axis=(1,2)), v.max(axis=(1,2)))
+        else:
+            vlut = rescale_lut(np.zeros(N), np.full(N, 255))
+        s = _saturation_table[delta, v]
+        smin = s.min(axis=(1,2))[:,None,None]
+        smax = s.max(axis=(1,2))[:,None,None]
+        # a constant saturation is unchanged
+        s = np.where(smax > smin, (s - smin) / np.where(smax > smin, smax - smin, 1), s)
+        w = (v[...,None] - frames).astype(np.float32)
+        w *= _reciprocal_table[delta][...,None]
+        w *= s[...,None]
+        np.subtract(1, w, out=w)
+        w *= vlut[n, v][...,None]
+        return w
+    else:
+        return np.stack([ preprocess(args, img_as_float(frame)).astype(np.float32) for frame in frames ])
+
+
+# _saturation_table[delta, v] = delta / v, the saturation of a pixel whose max and min values are v and v-delta.
+# _reciprocal_table[delta] = 1 / delta. Both are 0 for an achromatic pixel (delta = 0), as in rgb2hsv.
+with np.errstate(divide='ignore', invalid='ignore'):
+    _saturation_table = np.nan_to_num(np.arange(256, dtype=np.float32)[:,None] / np.arange(256, dtype=np.float32)[None,:],
+                                      nan=0.0, posinf=0.0)
+    _reciprocal_table = np.nan_to_num(1 / np.arange(256, dtype=np.float32), posinf=0.0)
+
+
+def output_specs(args):
+    "Returns a list of the outputs, each of which is a copy of args overwritten by a --spec option."
+    if len(args.spec) == 0:
+        return [args]
+    return [ argparse.Namespace(**{**vars(args), **spec}) for spec in args.spec ]
+
+
 def path(dir,i,presuc,j,ext):
     return os.path.join(args.dir,dir,"CLEVR_{:06d}_{}_{}.{}".format(i,presuc,j,ext))
 
@@ -81,129 +247,604 @@ def safe_load_json(path):
             return obj
 
 
-def main(args):
-
-    scenes=os.path.join(args.dir,"scene_tr")
-    files = [ f for f in os.listdir(scenes) if "---" not in f ]
-    files.sort()
-    filenum = len(files)
+def complete_transitions(files, samples):
+    "Returns the sorted list of the indices of the transitions whose samples are all present in the list of scene files."
+    found = {}
+    for f in files:
+        # CLEVR_XXXXXX_pre_YYY.json
+        try:
+            _, i, presuc, j = os.path.splitext(f)[0].split("_")
+            found.setdefault(int(i), set()).add((presuc, int(j)))
+        except ValueError:
+            continue
+    required = { (presuc, j) for presuc in ("pre","suc") for j in range(samples) }
+    return sorted( i for i, names in found.items() if required <= names )
+
+
+def scene_files(ids, samples):
+    "Returns the list of scene files of the transitions, ordered by states, then by samples."
+    return [ "CLEVR_{:06d}_{}_{:03d}.json".format(i,presuc,j)
+             for i in ids
+             for presuc in ("pre","suc")
+             for j in range(samples) ]
+
+
+def load_manifest(path):
+    """Read the scenes in a manifest written by render_images.py, one JSON object per line.
+Returns a dict from the name of the scene file to the scene, only with the fields needed for the extraction."""
+    manifest = {}
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                scene = json.loads(line)
+            except json.decoder.JSONDecodeError:
+                # e.g., the last line written by a job that was killed
+                print("ignoring a broken line in", path)
+                continue
+            # a sample rendered again overwrites the earlier one, as it does for the scene files
+            manifest[os.path.splitext(scene["image_filename"])[0]+".json"] = {
+                "image_filename" : scene["image_filename"],
+                "objects"        : [ { "bbox" : obj["bbox"] } for obj in scene["objects"] ],
+            }
+    return manifest
 
-    scene = safe_load_json(os.path.join(scenes,files[0]))
-    maxobj = len(scene["objects"])
-    imagefile = os.path.join(args.dir,"image_tr",scene["image_filename"])
-    picsize = imageio.imread(imagefile)[:,:,:3].shape
 
-    # .../CLEVR_XXXXXX_pre_YYY.png -> XXXXXX
-    start_idx = int(os.path.split(imagefile)[1].split("_")[1])
+def load_scene(args, manifest, scenefile):
+    if manifest is not None:
+        return manifest[scenefile]
+    return safe_load_json(os.path.join(args.dir,"scene_tr",scenefile))
 
-    if args.exclude_objects:
-        maxobj = 0
-    if args.include_background:
-        maxobj += 1
 
-    images = np.zeros((filenum, *picsize), dtype=np.uint8)
-    patches = np.zeros((filenum, maxobj, *args.resize, 3), dtype=np.uint8)
-    bboxes = np.zeros((filenum, maxobj, 4), dtype=np.uint16)
+# the stages of the extraction. Enabled by --profile.
+profile = Profile()
 
-    if args.include_background:
-        # picsize = (200, 300, 3)
-        # [0,0,300,200] --- xmin,ymin,xmax,ymax
-        bboxes[:,-1] = [0,0,picsize[1],picsize[0]]
 
-    print("extracting images")
-    # store states
-    for i,scenefile in tqdm.tqdm(enumerate(files),total=len(files)):
+def main(args):
 
-        scene = safe_load_json(os.path.join(scenes,scenefile))
+    samples = args.num_samples_per_state
+    if os.path.exists(os.path.join(args.dir,"scene_tr.jsonl")) and not args.no_manifest:
+        with profile.stage("scene manifest", nbytes=os.path.getsize(os.path.join(args.dir,"scene_tr.jsonl"))):
+            manifest = load_manifest(os.path.join(args.dir,"scene_tr.jsonl"))
+            files = list(manifest.keys())
+    else:
+        manifest = None
+        with profile.stage("scene listing"):
+            files = [ f for f in os.listdir(os.path.join(args.dir,"scene_tr")) if "---" not in f ]
+    ids = complete_transitions(files, samples)
+    if len(files) > 2 * samples * len(ids):
+        print("ignoring {} files of incomplete transitions".format(len(files) - 2 * samples * len(ids)))
+    files = scene_files(ids, samples)
+    if len(ids) == 0:
+        # e.g., --incremental while the first transition is being rendered
+        print("no transition is completely rendered in {} yet; nothing to extract".format(args.dir))
+        return
+
+    scene = load_scene(args, manifest, files[0])
+    numobj = len(scene["objects"])
+    imagefile = os.path.join(args.dir,"image_tr",scene["image_filename"])
+    picsize = imageio.imread(imagefile)[:,:,:3].shape
 
-        imagefile = os.path.join(args.dir,"image_tr",scene["image_filename"])
-        image_ubyte = imageio.imread(imagefile)[:,:,:3] # range: [0,   255]
-        image = img_as_float(image_ubyte)               # range: [0.0, 1.0]
-        image = preprocess(args,image)
-        assert(picsize==image.shape)
-        images[i] = image_ubyte
-        if args.include_background:
-            # note: resize may cause numerical error that makes values exceed 0.0,1.0.
-            # the value is now from 0 to 255.
-            patches[i,-1] = img_as_ubyte(np.clip(skimage.transform.resize(image,(*args.resize,3)), 0.0, 1.0))
-        if args.exclude_objects:
+    specs = output_specs(args)
+    # the transitions already in each output
+    done = { spec.out : set() for spec in specs }
+    if args.incremental:
+        for spec in specs:
+            done[spec.out] = existing_transitions(spec, picsize)
+        ids = [ i for i in ids if any(i not in done[spec.out] for spec in specs) ]
+        print("{} new transitions".format(len(ids)))
+        if len(ids) == 0:
+            return
+        files = scene_files(ids, samples)
+
+    num_transitions = len(ids)
+    num_states = 2 * num_transitions
+
+    if args.jobs > 1:
+        zeros = shared_zeros
+    else:
+        zeros = np.zeros
+
+    # the per-state means and variances. Unlike the per-sample arrays, they do not grow with the number of samples.
+    outputs = []
+    for spec in specs:
+        maxobj = numobj
+        if spec.exclude_objects:
+            maxobj = 0
+        if spec.include_background:
+            maxobj += 1
+        if spec.as_problem:
+            # the values are not rounded when stored as a problem
+            mean_dtype, var_dtype = np.float64, np.float64
+        else:
+            mean_dtype, var_dtype = np.uint8, np.uint16
+        outputs.append((spec,
+                        zeros((num_states, maxobj, *spec.resize, 3), dtype=mean_dtype),
+                        zeros((num_states, maxobj, *spec.resize, 3), dtype=var_dtype),
+                        zeros((num_states, maxobj, 4), dtype=np.float64),
+                        zeros((num_states, maxobj, 4), dtype=np.float64)))
+
+    # the transition of each state, and which states are new to each output
+    state_ids = np.repeat(ids, 2)
+    new = { spec.out : np.array([ i not in done[spec.out] for i in state_ids ], dtype=bool) for spec in specs }
+
+    stores = {}
+    for spec in specs:
+        if spec.format != "chunked":
             continue
+        if args.incremental and os.path.exists(os.path.join(spec.out, "index.json")):
+            stores[spec.out] = ChunkedStore(spec.out)
+        else:
+            stores[spec.out] = ChunkedStore.create(spec.out, chunk_size=args.store_chunk_size,
+                                                   metadata=dataset_metadata(spec, picsize))
+
+    if args.frame_cache and args.incremental:
+        # the cache is keyed on the list of images, which differs in every incremental run,
+        # thus it would be rebuilt with only the new frames each time
+        print("--frame-cache is ignored with --incremental")
+        cache = None
+    elif args.frame_cache:
+        cache = FrameCache(args.dir, [ os.path.splitext(f)[0]+".png" for f in files ], picsize)
+    else:
+        cache = None
 
-        for j, obj in enumerate(scene["objects"]):
-            bbox = tuple(obj["bbox"])
-            x1, y1, x2, y2 = bbox
-            region = image[int(y1):int(y2), int(x1):int(x2), :]
-            # note: resize may cause numerical error that makes values exceed 0.0,1.0
-            patches[i,j] = img_as_ubyte(np.clip(skimage.transform.resize(region,(*args.resize,3)), 0.0, 1.0))
-            bboxes[i,j] = bbox
+    chunksize = states_per_chunk(args, picsize, outputs, num_states)
+    chunks = [ range(k, min(k+chunksize, num_states)) for k in range(0, num_states, chunksize) ]
 
-    print("computing means and variances")
-    samples = args.num_samples_per_state
-    num_states = filenum // samples
-    num_transitions = num_states // 2
-    images = images.reshape((num_states, samples, *picsize))
-    patches = patches.reshape((num_states, samples, maxobj, *args.resize, 3))
-    bboxes = bboxes.reshape((num_states, samples, maxobj, 4))
-    images_mean = images.mean(axis=1) # [0, 2^8-1]
-    patches_mean = patches.mean(axis=1)
-    bboxes_mean = bboxes.mean(axis=1)
-    images_std = images.std(axis=1) # [0, 2^8-1]
-    patches_std = patches.std(axis=1)
-    bboxes_std = bboxes.std(axis=1)
-    images_var = images.var(axis=1) # [0, 2^16-1]
-    patches_var = patches.var(axis=1)
-    bboxes_var = bboxes.var(axis=1)
-    coords_mean = bboxes_to_coord(bboxes_mean,"mean")
-    coords_var = bboxes_to_coord(bboxes_var,"variance")
-
-    images_mean2 = images_mean.reshape((num_transitions, 2, *picsize))
-    images_std2  = images_std.reshape((num_transitions, 2, *picsize))
+    print("extracting images and computing means and variances, {} states per chunk".format(chunksize))
     os.makedirs(os.path.join(args.dir,"distr_tr"),exist_ok=True)
-    for i in tqdm.tqdm(range(num_transitions)):
-        for presuc,j in (("pre",0),("suc",1)):
-            if os.path.exists(path("distr_tr",start_idx+i,presuc,"mean","png")):
+    context = (args, manifest, files, picsize, ids, outputs, cache)
+    if args.jobs > 1:
+        finished = extract_parallel(context, chunks)
+    else:
+        finished = extract_serial(context, chunks)
+    for states in tqdm.tqdm(finished, total=len(chunks), unit="chunk"):
+        # the chunks finish in order, thus the results are appended to the stores as they become available
+        for spec, patches_mean, patches_var, bboxes_mean, bboxes_var in outputs:
+            if spec.out not in stores:
                 continue
-            imageio.imwrite(path("distr_tr",start_idx+i,presuc,"mean","png"), img_as_ubyte(images_mean2[i,j]/255))
-            imageio.imwrite(path("distr_tr",start_idx+i,presuc,"std","png"), img_as_ubyte(images_std2[i,j]/255))
+            store = stores[spec.out]
+            rows = np.arange(states.start, states.stop)[new[spec.out][states.start:states.stop]]
+            fields = dataset_fields(patches_mean[rows], patches_var[rows],
+                                    bboxes_to_coord(bboxes_mean[rows],"mean"),
+                                    bboxes_to_coord(bboxes_var[rows],"variance"),
+                                    np.arange(len(store), len(store)+len(rows)),
+                                    state_ids[rows])
+            with profile.stage("save", count=len(rows), nbytes=sum(v.nbytes for v in fields.values())):
+                store.append(**fields)
+    if cache is not None:
+        with profile.stage("frame cache"):
+            cache.commit()
+
+    for spec, patches_mean, patches_var, bboxes_mean, bboxes_var in outputs:
+        if spec.out in stores:
+            continue
+        rows = new[spec.out]
+        if rows.all():
+            rows = slice(None)  # avoids copying
+        coords_mean = bboxes_to_coord(bboxes_mean[rows],"mean")
+        coords_var = bboxes_to_coord(bboxes_var[rows],"variance")
+
+        if spec.as_problem:
+            save_as = save_as_problem
+        else:
+            save_as = save_as_dataset
+        with profile.stage("save", count=len(state_ids[rows])):
+            save_as(spec,samples,num_states,num_transitions,
+                    patches_mean[rows],patches_var[rows],
+                    coords_mean,coords_var,
+                    picsize,state_ids[rows])
+        profile.add("save", nbytes=os.path.getsize(spec.out))
+
+    pass
+
 
-    if args.as_problem:
-        save_as = save_as_problem
+def existing_transitions(spec, picsize):
+    "Returns the set of the transitions stored in an existing output, after checking that it is compatible with spec."
+    if spec.format == "chunked":
+        if not os.path.exists(os.path.join(spec.out, "index.json")):
+            return set()
+        return _existing_transitions(spec, picsize, ChunkedStore(spec.out))
     else:
-        save_as = save_as_dataset
-    save_as(args,samples,num_states,num_transitions,
-            patches_mean,patches_var,
-            coords_mean,coords_var,
-            picsize)
+        if not os.path.exists(spec.out):
+            return set()
+        with np.load(spec.out) as data:
+            return _existing_transitions(spec, picsize, data)
+
+
+def _existing_transitions(spec, picsize, data):
+    for key, value in dataset_metadata(spec, picsize).items():
+        if not np.array_equal(data[key], value):
+            raise ValueError("{}: {} is {}, while the current extraction has {}".format(spec.out, key, data[key], value))
+    if "transition_ids" not in data:
+        raise ValueError("{}: the output does not record the transition ids. Extract it again without --incremental".format(spec.out))
+    return set(np.asarray(data["transition_ids"]).tolist())
+
+
+def accumulator_dtype(dtype, samples):
+    "Returns the unsigned integer type that holds the sum of squares of the samples without overflow."
+    if np.iinfo(dtype).max ** 2 * samples < 2 ** 32:
+        return np.uint32
+    else:
+        return np.uint64
+
+
+def accumulate(s, ss, x):
+    "Add a batch of samples (along the first axis of x) to the running sum and the running sum of squares."
+    x = x.astype(s.dtype)
+    s += x.sum(axis=0, dtype=s.dtype)
+    ss += (x * x).sum(axis=0, dtype=s.dtype)
+
+
+def finalize_moments(s, ss, samples, mean, var):
+    """Store the mean and the variance of the accumulated samples into mean and var.
+The sums are exact integers, thus the single-pass formula n^2 Var = n sum(x^2) - sum(x)^2 does not suffer from
+the cancellation it has in floating point. When the output is an integer array, the results are rounded down,
+as astype() does."""
+    s  = s.astype(np.uint64)
+    ss = ss.astype(np.uint64)
+    m2 = samples * ss - s * s
+    if np.issubdtype(mean.dtype, np.integer):
+        mean[...] = s // samples
+        var[...]  = m2 // (samples * samples)
+    else:
+        mean[...] = s / samples
+        var[...]  = m2 / (samples * samples)
+
+
+def states_per_chunk(args, picsize, outputs, num_states):
+    "Returns the number of states processed at once by a worker, which fits the accumulators in --max-memory."
+    samples = args.num_samples_per_state
+    def nbytes(shape, dtype):
+        return int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+    output_bytes = sum(sum(array.nbytes for array in output[1:]) for output in outputs)
+    # the buffers of a worker for the state being processed (see extract_states):
+    # the decoded samples, and the preprocessed images, which are float64 without preprocessing or with skimage
+    mode = args.preprocess_mode if args.preprocess else 0
+    batched = args.preprocess_method == "batched" and mode != 0
+    worker_bytes = samples * nbytes(picsize, np.uint8) + samples * nbytes(picsize, np.float32 if batched else np.float64)
+    if batched:
+        # the temporaries of preprocess_batch
+        worker_bytes += samples * nbytes(picsize, np.float32)
+    if args.resize_method == "batched":
+        # the windows of crop_and_resize, which are gathered in batches of at most the images in float32
+        worker_bytes += samples * nbytes(picsize, np.float32)
+    # the mean and the variance of the images written into distr_tr
+    worker_bytes += 2 * nbytes(picsize, np.float64)
+    state_bytes = 2 * nbytes(picsize, accumulator_dtype(np.uint8, samples))
+    for spec, patches_mean, patches_var, bboxes_mean, bboxes_var in outputs:
+        # the patches of the samples, the resized regions before they are copied into the patches,
+        # and the patches in the accumulator type and their squares in accumulate
+        worker_bytes += samples * (2 * nbytes(patches_mean.shape[1:], np.uint8)
+                                   + 2 * nbytes(patches_mean.shape[1:], accumulator_dtype(np.uint8, samples)))
+        state_bytes += 2 * nbytes(patches_mean.shape[1:], accumulator_dtype(np.uint8, samples))
+        state_bytes += 2 * nbytes(bboxes_mean.shape[1:], accumulator_dtype(np.uint16, samples))
+
+    available = args.max_memory - output_bytes - args.jobs * worker_bytes
+    if available < args.jobs * state_bytes:
+        print("warning: the output arrays and the workers take {} bytes, exceeding --max-memory {}".format(
+            output_bytes + args.jobs * worker_bytes, args.max_memory))
+        return 1
+    # the chunks should be small enough for balancing the load among the workers
+    return max(1, min(available // (args.jobs * state_bytes),
+                      -(-num_states // (args.jobs * 4))))
+
+
+def extract_states(args, manifest, files, picsize, ids, outputs, cache, states):
+    """Extract the patches from the samples of the states in a range, and store their means and variances in the outputs.
+Each sample is added to the running sums of its state as soon as it is decoded,
+thus the memory usage is proportional to the number of states in the range, not to the number of samples."""
+    samples = args.num_samples_per_state
+    base = states.start
+
+    # the distribution images are written only once
+    distr = [ not os.path.exists(path("distr_tr",ids[k//2],("pre","suc")[k%2],"mean","png"))
+              for k in states ]
+    acc_type = accumulator_dtype(np.uint8, samples)
+    images_sum   = np.zeros((len(states), *picsize), dtype=acc_type)
+    images_sumsq = np.zeros((len(states), *picsize), dtype=acc_type)
+    accumulators = []
+    for spec, patches_mean, patches_var, bboxes_mean, bboxes_var in outputs:
+        accumulators.append((np.zeros((len(states), *patches_mean.shape[1:]), dtype=acc_type),
+                             np.zeros((len(states), *patches_mean.shape[1:]), dtype=acc_type),
+                             np.zeros((len(states), *bboxes_mean.shape[1:]), dtype=accumulator_dtype(np.uint16, samples)),
+                             np.zeros((len(states), *bboxes_mean.shape[1:]), dtype=accumulator_dtype(np.uint16, samples))))
+
+    frames = np.zeros((samples, *picsize), dtype=np.uint8)
+    if args.preprocess_method == "skimage":
+        images = np.zeros((samples, *picsize))
+    for k in states:
+        sample_scenes = []
+        for j, i in enumerate(range(k*samples, (k+1)*samples)):
+            with profile.stage("scene json"):
+                scene = load_scene(args, manifest, files[i])
+
+            if cache is not None and cache.valid:
+                with profile.stage("frame cache", nbytes=frames[j].nbytes):
+                    image_ubyte = cache[i]
+            else:
+                imagefile = os.path.join(args.dir,"image_tr",scene["image_filename"])
+                with profile.stage("png decode", nbytes=frames[j].nbytes):
+                    image_ubyte = imageio.imread(imagefile)[:,:,:3] # range: [0,   255]
+                if cache is not None:
+                    with profile.stage("frame cache", count=0):
+                        cache[i] = image_ubyte
+            assert(picsize==image_ubyte.shape)
+            frames[j] = image_ubyte
+            if args.preprocess_method == "skimage":
+                with profile.stage("preprocess", nbytes=frames[j].nbytes):
+                    image = img_as_float(image_ubyte)           # range: [0.0, 1.0]
+                    images[j] = preprocess(args,image)
+            sample_scenes.append(scene)
+        if args.preprocess_method == "batched":
+            with profile.stage("preprocess", count=samples, nbytes=frames.nbytes):
+                images = preprocess_batch(args,frames)
+
+        if distr[k-base]:
+            with profile.stage("moments", count=0, nbytes=frames.nbytes):
+                accumulate(images_sum[k-base], images_sumsq[k-base], frames)
+        for (spec, patches_mean, _, bboxes_mean, _), (patches_sum, patches_sumsq, bboxes_sum, bboxes_sumsq) \
+                in zip(outputs, accumulators):
+            patches = np.zeros((samples, *patches_mean.shape[1:]), dtype=np.uint8)
+            bboxes  = np.zeros((samples, *bboxes_mean.shape[1:]), dtype=np.uint16)
+            with profile.stage("resize", count=patches.shape[0]*patches.shape[1], nbytes=patches.nbytes):
+                extract_patches(spec, sample_scenes, images, patches, bboxes)
+            with profile.stage("moments", count=0, nbytes=patches.nbytes+bboxes.nbytes):
+                accumulate(patches_sum[k-base], patches_sumsq[k-base], patches)
+                accumulate(bboxes_sum[k-base], bboxes_sumsq[k-base], bboxes)
+        if args.preprocess_method == "batched":
+            # release the images before those of the next state are allocated
+            del images
+
+    chunk = slice(states.start, states.stop)
+    with profile.stage("moments", count=len(states)):
+        for (spec, patches_mean, patches_var, bboxes_mean, bboxes_var), (patches_sum, patches_sumsq, bboxes_sum, bboxes_sumsq) \
+                in zip(outputs, accumulators):
+            finalize_moments(patches_sum, patches_sumsq, samples, patches_mean[chunk], patches_var[chunk])
+            finalize_moments(bboxes_sum, bboxes_sumsq, samples, bboxes_mean[chunk], bboxes_var[chunk])
+
+    for k in states:
+        if not distr[k-base]:
+            continue
+        with profile.stage("distr png", count=2):
+            images_mean = np.zeros(picsize)
+            images_var  = np.zeros(picsize)
+            finalize_moments(images_sum[k-base], images_sumsq[k-base], samples, images_mean, images_var)
+            presuc = ("pre","suc")[k%2]
+            imageio.imwrite(path("distr_tr",ids[k//2],presuc,"mean","png"), img_as_ubyte(images_mean/255))
+            imageio.imwrite(path("distr_tr",ids[k//2],presuc,"std","png"), img_as_ubyte(np.sqrt(images_var)/255))
+
+
+def extract_patches(spec, scenes, images, patches, bboxes):
+    """Store the patches and the bounding boxes of the objects in a batch of images, as specified by an output spec.
+patches and bboxes have the shape (len(images), maxobj, Y, X, 3) and (len(images), maxobj, 4)."""
+    N, H, W, _ = images.shape
+    boxes   = []                # x1,y1,x2,y2
+    indices = []                # the image of each box
+    targets = []                # the location of each patch in the output
+    if spec.include_background:
+        # picsize = (200, 300, 3)
+        # [0,0,300,200] --- xmin,ymin,xmax,ymax
+        bboxes[:,-1] = [0,0,W,H]
+        for i in range(N):
+            boxes.append((0,0,W,H))
+            indices.append(i)
+            targets.append((i,-1))
+    if not spec.exclude_objects:
+        for i, scene in enumerate(scenes):
+            for j, obj in enumerate(scene["objects"]):
+                bboxes[i,j] = obj["bbox"]
+                boxes.append(obj["bbox"])
+                indices.append(i)
+                targets.append((i,j))
+
+    if len(boxes) == 0:
+        return
+    if spec.resize_method == "batched":
+        results = crop_and_resize(images, np.array(indices), np.array(boxes), spec.resize)
+    else:
+        results = []
+        for i, (x1, y1, x2, y2) in zip(indices, boxes):
+            region = images[i, int(y1):int(y2), int(x1):int(x2), :]
+            # note: resize may cause numerical error that makes values exceed 0.0,1.0.
+            # the value is now from 0 to 255.
+            results.append(img_as_ubyte(np.clip(skimage.transform.resize(region,(*spec.resize,3)), 0.0, 1.0)))
+    for (i, j), result in zip(targets, results):
+        patches[i,j] = result
+
+
+_resize_matrices = {}
+
+def resize_matrix(n_in, n_out):
+    """Returns the (n_out, n_in) matrix of the linear operator that skimage.transform.resize applies along an axis
+of length n_in resized to n_out, i.e., the anti-aliasing gaussian filter followed by the linear interpolation."""
+    key = (n_in, n_out)
+    if key not in _resize_matrices:
+        # The other axis is not resized and is not filtered. Thus column j is the response to the unit impulse at j.
+        _resize_matrices[key] = skimage.transform.resize(np.eye(n_in), (n_out, n_in)).astype(np.float32)
+    return _resize_matrices[key]
+
+
+def slice_bounds(start, stop, n):
+    "Vectorized slice(start, stop).indices(n) for integer arrays."
+    start = np.where(start < 0, np.maximum(start + n, 0), np.minimum(start, n))
+    stop  = np.where(stop  < 0, np.maximum(stop  + n, 0), np.minimum(stop,  n))
+    return start, np.maximum(start, stop)
+
+
+def window_size(n):
+    "Rounds the region sizes up to powers of two, which identify the buckets of crop_and_resize."
+    return 2 ** np.ceil(np.log2(np.maximum(n, 1))).astype(int)
+
+
+def crop_and_resize(images, indices, boxes, shape):
+    """Crop the regions boxes[b] = (x1,y1,x2,y2) of images[indices[b]] and resize them to shape = (Y,X).
+Returns a uint8 array of shape (len(boxes),Y,X,C).
+
+skimage.transform.resize applies a separable linear operator to an image, thus the resized region is
+Ay @ region @ Ax^T (for each channel), where Ay and Ax depend only on the size of the region (see resize_matrix).
+The regions are bucketed by their sizes rounded up to powers of two, so that a small region is not padded
+to the size of a large one (e.g., the whole image of include-background). The regions of a bucket are gathered
+into zero-padded windows of the largest region size in the bucket, and the matrices are padded likewise,
+so that they are resized by two batched matrix products.
+The windows are gathered in batches, so that the float32 buffers of a batch take at most as many bytes as
+the images would in float32 (or those of a single region, if it is larger)."""
+    N, H, W, C = images.shape
+    Y, X = shape
+    boxes = boxes.astype(int)   # truncate as int() does
+    y1, y2 = slice_bounds(boxes[:,1], boxes[:,3], H)
+    x1, x2 = slice_bounds(boxes[:,0], boxes[:,2], W)
+    h, w = y2 - y1, x2 - x1
+
+    results = np.zeros((len(boxes), Y, X, C), dtype=np.uint8)
+    _, buckets = np.unique(np.stack((window_size(h), window_size(w)), axis=1), axis=0, return_inverse=True)
+    buckets = buckets.ravel()
+    for bucket in range(buckets.max()+1):
+        members = np.flatnonzero(buckets == bucket)
+        maxh, maxw = h[members].max(), w[members].max()
+        # the window, the product with Ay, the result, Ay and Ax of a region
+        region_bytes = 4 * (maxh*maxw*C + Y*maxw*C + Y*X*C + Y*maxh + X*maxw)
+        if images.dtype != np.float32:
+            region_bytes += maxh*maxw*C * images.itemsize  # the window before it is converted
+        batch = max(1, (images.size * 4) // region_bytes)
+        for k in range(0, len(members), batch):
+            b = members[k:k+batch]
+            results[b] = _crop_and_resize(images, indices[b], y1[b], x1[b], h[b], w[b], maxh, maxw, shape)
+    return results
+
+
+def _crop_and_resize(images, indices, y1, x1, h, w, maxh, maxw, shape):
+    "crop_and_resize of the regions of a batch, gathered into windows of size (maxh,maxw)."
+    N, H, W, C = images.shape
+    Y, X = shape
+    B = len(indices)
+
+    Ay = np.zeros((B, Y, maxh), dtype=np.float32)
+    Ax = np.zeros((B, X, maxw), dtype=np.float32)
+    for b in range(B):
+        Ay[b, :, :h[b]] = resize_matrix(h[b], Y)
+        Ax[b, :, :w[b]] = resize_matrix(w[b], X)
+
+    # the pixels outside the regions are multiplied by zero
+    rows = np.minimum(y1[:,None] + np.arange(maxh), H-1)
+    cols = np.minimum(x1[:,None] + np.arange(maxw), W-1)
+    regions = images[indices[:,None,None], rows[:,:,None], cols[:,None,:]].astype(np.float32, copy=False)
+
+    results = np.matmul(Ay, regions.reshape((B, maxh, maxw*C))).reshape((B, Y, maxw, C))
+    del regions
+    results = np.matmul(Ax[:,None], results)   # (B,1,X,maxw) @ (B,Y,maxw,C) -> (B,Y,X,C)
+    # same as img_as_ubyte(np.clip(results, 0.0, 1.0))
+    np.clip(results, 0.0, 1.0, out=results)
+    results *= 255
+    return np.rint(results).astype(np.uint8)
+
+
+def shared_zeros(shape, dtype):
+    "Allocate a zero-filled array in a shared memory segment that survives fork(), so that the workers can write into it."
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    if size == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.frombuffer(multiprocessing.RawArray('b', size), dtype=dtype).reshape(shape)
+
+
+# the arguments of extract_states shared with the forked workers. Passing them through fork
+# avoids pickling the output buffers.
+_worker_context = None
+
+def _extract_chunk(states):
+    # the stages are recorded in the profile of the worker and sent back to the parent
+    profile.reset()
+    extract_states(*_worker_context, states)
+    return states, profile.stages
+
+
+def extract_serial(context, chunks):
+    "Process the chunks of states one by one, and yield each chunk when it is finished."
+    for states in chunks:
+        extract_states(*context, states)
+        yield states
+
+
+def extract_parallel(context, chunks):
+    "Process the chunks of states in worker processes, and yield each chunk in the original order when it is finished."
+    global _worker_context
+    _worker_context = context
+    with multiprocessing.get_context("fork").Pool(context[0].jobs) as pool:
+        for states, stages in pool.imap(_extract_chunk, chunks):
+            profile.merge(stages)
+            yield states
+    _worker_context = None
+
+
+def dataset_metadata(args, picsize):
+    return dict(picsize=picsize,
+                patch_shape=[*args.resize,3],
+                num_samples_per_state=args.num_samples_per_state)
+
+
+def dataset_fields(patches_mean, patches_var, coords_mean, coords_var, transitions, transition_ids):
+    # note: the name mismatch (images vs patches) is not a mistake,
+    # an artifact of history of changes.
+    return dict(images_mean=patches_mean.astype(np.uint8),
+                images_var=patches_var.astype(np.uint16),
+                coords_mean=coords_mean.astype(np.uint16),
+                coords_var=coords_var.astype(np.uint32),
+                # store state ids
+                transitions=transitions.astype(np.uint32),
+                # the index of the rendered transition (XXXXXX in CLEVR_XXXXXX_pre_YYY.png) each state belongs to
+                transition_ids=transition_ids.astype(np.uint32))
 
-    pass
 
 def save_as_dataset(args,
                     samples,num_states,num_transitions,
                     patches_mean,patches_var,
                     coords_mean,coords_var,
-                    picsize):
-
-    np.savez_compressed(args.out,
-                        # note: the name mismatch (images vs patches) is not a mistake,
-                        # an artifact of history of changes.
-                        images_mean=patches_mean.astype(np.uint8),
-                        images_var=patches_var.astype(np.uint16),
-                        coords_mean=coords_mean.astype(np.uint16),
-                        coords_var=coords_var.astype(np.uint32),
-                        # metadata
-                        picsize=picsize,
-                        patch_shape=[*args.resize,3],
-                        num_samples_per_state=args.num_samples_per_state,
-                        # store state ids
-                        transitions=np.arange(num_states, dtype=np.uint32))
-    args.out.truncate()
+                    picsize,transition_ids):
+
+    fields = dataset_fields(patches_mean, patches_var,
+                            coords_mean, coords_var,
+                            np.arange(len(patches_mean)),
+                            transition_ids)
+    if args.incremental and os.path.exists(args.out):
+        append_dataset(args, fields, picsize)
+        return
+
+    with open(args.out, "wb") as f:
+        savez(f, args.codec,
+              **fields,
+              **dataset_metadata(args, picsize))
+
+
+def append_dataset(args, fields, picsize):
+    """Rewrite the existing npz output of --incremental with the fields of the new states appended.
+As in merge-npz.py, each array is streamed into the new archive with NpzWriter, the existing part first,
+so that only a single array of the existing output is in memory at any time.
+The new archive is written to a temporary file, which replaces the output when it is complete."""
+    length = array_headers(args.out)["transitions"][0][0]
+    tmp = args.out + ".tmp"
+    try:
+        with NpzWriter(tmp, args.codec) as writer, np.load(args.out) as data:
+            for name, array in fields.items():
+                with writer.stream(name, array.dtype, (length + len(array), *array.shape[1:])) as member:
+                    member.write(data[name])
+                    if name == "transitions":
+                        array = array + length # the state ids continue from the existing ones
+                    member.write(array)
+            for name, value in dataset_metadata(args, picsize).items():
+                writer.write(name, value)
+        os.replace(tmp, args.out)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
 
 def save_as_problem(args,
                     samples,num_states,num_transitions,
                     patches_mean,patches_var,
                     coords_mean,coords_var,
-                    picsize):
+                    picsize,transition_ids):
 
     B,O,H,W,C = patches_mean.shape
     patches_mean = patches_mean.reshape((B,O,H*W*C)) / 255
@@ -212,14 +853,14 @@ def save_as_problem(args,
     states_var = np.concatenate((patches_var,coords_var),axis=-1)
     states = np.concatenate((states_mean,states_var),axis=-1)
     init,goal = states
-    np.savez_compressed(args.out,
-                        init=init,
-                        goal=goal,
-                        # metadata
-                        picsize=picsize,
-                        patch_shape=[*args.resize,3],
-                        num_samples_per_state=args.num_samples_per_state,)
-    args.out.truncate()
+    with open(args.out, "wb") as f:
+        savez(f, args.codec,
+              init=init,
+              goal=goal,
+              # metadata
+              picsize=picsize,
+              patch_shape=[*args.resize,3],
+              num_samples_per_state=args.num_samples_per_state,)
 
 
 
@@ -243,7 +884,15 @@ def bboxes_to_coord(bboxes,mode="mean"):
 if __name__ == '__main__':
     import sys
     args = parser.parse_args()
+    if any(spec.format == "chunked" and spec.as_problem for spec in output_specs(args)):
+        parser.error("the chunked format does not support --as-problem")
+    if args.incremental and any(spec.as_problem for spec in output_specs(args)):
+        parser.error("--incremental does not support --as-problem")
+    profile.enabled = args.profile is not None
     main(args)
+    if profile.enabled:
+        profile.print_summary()
+        profile.save(args.profile)
 
 
 
@@ -0,0 +1,48 @@
+"""
+A persistent index of the fingerprints of the rendered transitions (see State.fingerprint),
+shared by the jobs that render into the same output directory without a server.
+
+Each job appends to its own partition, dir/<start>-<stop>.txt for the range of transitions it renders,
+one fingerprint per line, and reads the partitions of all jobs. refresh() reads the lines
+appended by the other jobs since the last call, so that a job sees the transitions rendered concurrently.
+"""
+
+import os
+
+
+def transition_fingerprint(pre, suc):
+  return pre.fingerprint() + "-" + suc.fingerprint()
+
+
+class FingerprintIndex(object):
+
+  def __init__(self, dir, start, stop):
+    os.makedirs(dir, exist_ok=True)
+    self.dir          = dir
+    self.path         = os.path.join(dir, "{:06d}-{:06d}.txt".format(start, stop))
+    self.fingerprints = set()
+    self.offsets      = {}          # partition -> the number of bytes already read
+    self.refresh()
+
+  def refresh(self):
+    for name in sorted(os.listdir(self.dir)):
+      if not name.endswith(".txt"):
+        continue
+      with open(os.path.join(self.dir, name), "rb") as f:
+        f.seek(self.offsets.get(name, 0))
+        data = f.read()
+      # a line being written by another job is read by the next refresh
+      data = data[:data.rfind(b"\n")+1]
+      self.offsets[name] = self.offsets.get(name, 0) + len(data)
+      self.fingerprints.update(data.decode().split())
+
+  def __contains__(self, fingerprint):
+    return fingerprint in self.fingerprints
+
+  def __len__(self):
+    return len(self.fingerprints)
+
+  def add(self, fingerprint):
+    with open(self.path, "a") as f:
+      f.write(fingerprint + "\n")
+    self.fingerprints.add(fingerprint)
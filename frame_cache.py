@@ -0,0 +1,62 @@
+"""
+An on-disk cache of the decoded frames of a render directory.
+
+The uint8 RGB frames of all images are stored in a single .npy file, dir/frames.npy,
+which is read through a memory map. dir/frames.json records the image files, their modification times and sizes.
+The cache is used only when the list of images and their modification times and sizes match the current ones,
+and it is rebuilt otherwise. The record is written only after all frames are stored,
+thus an interrupted build is never used.
+"""
+
+import numpy as np
+import json
+import os
+
+
+class FrameCache(object):
+
+    def __init__(self, dir, imagefiles, picsize):
+        """imagefiles: the basenames of the images in dir/image_tr/, in the order of the frames.
+picsize: the shape of a frame, (H,W,3)."""
+        self.npy  = os.path.join(dir, "frames.npy")
+        self.json = os.path.join(dir, "frames.json")
+        self.key  = {
+            "picsize" : list(picsize),
+            "images"  : [ (f, st.st_mtime_ns, st.st_size)
+                          for f in imagefiles
+                          for st in [os.stat(os.path.join(dir, "image_tr", f))] ],
+        }
+        self.valid = False
+        try:
+            with open(self.json, "r") as f:
+                # json does not distinguish tuples and lists
+                self.valid = json.load(f) == json.loads(json.dumps(self.key))
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            pass
+
+        if self.valid:
+            self.frames = np.load(self.npy, mmap_mode="r")
+        else:
+            print("frame cache is missing or outdated; rebuilding", self.npy)
+            if os.path.exists(self.json):
+                os.remove(self.json)
+            self.frames = np.lib.format.open_memmap(self.npy, mode="w+", dtype=np.uint8,
+                                                    shape=(len(imagefiles), *picsize))
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def __setitem__(self, i, frame):
+        assert not self.valid
+        self.frames[i] = frame
+
+    def commit(self):
+        "Mark the cache as complete, after all frames are stored."
+        if self.valid:
+            return
+        self.frames.flush()
+        tmp = self.json + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.key, f)
+        os.replace(tmp, self.json)
+        self.valid = True
@@ -6,7 +6,7 @@ then
     cat <<EOF >&2
 
 
-    Usage: generate_all.sh [objs] [num_transitions] [num_samples_per_state] [num_jobs] [gpu] [suffix]
+    Usage: generate_all.sh [objs] [num_transitions] [num_samples_per_state] [num_jobs] [gpu] [suffix] [skip_duplicates]
     
       objs:   specity the number of objects, default = 2
     
@@ -20,6 +20,9 @@ then
     
       suffix:  arbitrary string to be attached to the name of the output directory.
 
+      skip_duplicates:  if true, do not render a transition whose logical states were already rendered by any of the jobs
+                        (render_images.py --skip-duplicates). default : false.
+
 
     Generate scenes randomly and render them.
     It reads an environment variable $SUBMIT as a job submission command template.
@@ -37,6 +40,7 @@ export num_samples_per_state=${1:-3} ; shift 1
 export num_jobs=${1:-1}     ; shift 1
 export gpu=${1:-true}       ; shift 1
 export suffix=$1            ; shift 1
+export skip_duplicates=${1:-false} ; shift 1
 
 if [ $num_jobs -gt 1 ]
 then
@@ -51,6 +55,11 @@ if $gpu
 then
     export use_gpu="--use-gpu 1"
 fi
+export dedup=""
+if $skip_duplicates
+then
+    export dedup="--skip-duplicates --fingerprint-dir $dir/fingerprints"
+fi
   
 
 SUBMIT=${SUBMIT:-"jbsub -mem 4g -cores 1+1 -queue x86_6h -proj $proj -require 'v100||a100'"}
@@ -76,11 +85,14 @@ job (){
                         --object-jitter 0.1      \
                         --start-idx $start_idx   \
                         --num-transitions $num_transitions \
-                        --num-samples-per-state $num_samples_per_state
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --out $output_dir-objs.npz --resize 16 16 $output_dir
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --out $output_dir-bgnd.npz --resize 16 16 --include-background $output_dir
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --out $output_dir-flat.npz --resize 30 45 --include-background --exclude-objects $output_dir
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --out $output_dir-high.npz --resize 80 120 --include-background --exclude-objects $output_dir
+                        --num-samples-per-state $num_samples_per_state \
+                        $dedup
+    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state \
+                                    --spec out=$output_dir-objs.npz,resize=16x16 \
+                                    --spec out=$output_dir-bgnd.npz,resize=16x16,include-background \
+                                    --spec out=$output_dir-flat.npz,resize=30x45,include-background,exclude-objects \
+                                    --spec out=$output_dir-high.npz,resize=80x120,include-background,exclude-objects \
+                                    $output_dir
 }
 
 export -f job
@@ -64,10 +64,12 @@ job (){
                         --object-jitter 0.1      \
                         --num-transitions 1 \
                         --num-samples-per-state $num_samples_per_state
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --as-problem --out $output_dir/objs.npz --resize 16 16 $output_dir
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --as-problem --out $output_dir/bgnd.npz --resize 16 16 --include-background $output_dir
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --as-problem --out $output_dir/flat.npz --resize 30 45 --include-background --exclude-objects $output_dir
-    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --as-problem --out $output_dir/high.npz --resize 80 120 --include-background --exclude-objects $output_dir
+    ./extract_all_regions_binary.py --num-samples-per-state $num_samples_per_state --as-problem \
+                                    --spec out=$output_dir/objs.npz,resize=16x16 \
+                                    --spec out=$output_dir/bgnd.npz,resize=16x16,include-background \
+                                    --spec out=$output_dir/flat.npz,resize=30x45,include-background,exclude-objects \
+                                    --spec out=$output_dir/high.npz,resize=80x120,include-background,exclude-objects \
+                                    $output_dir
 }
 
 for i in $(seq $num_problems)
@@ -1,52 +1,119 @@
 #!/usr/bin/env python3
 
 import numpy as np
+import os
 import argparse
 import tqdm
+import collections
+import contextlib
+import concurrent.futures
+
+from archive import NpzWriter, array_headers, valid_length, codec_type, fields, optional_fields
 
 parser = argparse.ArgumentParser(description='merge npz files.')
 
-parser.add_argument('--out', type=argparse.FileType('wb'), default='regions.npz', help="output npz pathname.")
+parser.add_argument('--out', default='regions.npz',
+                    help="output npz pathname. It is written only after all inputs are checked to be compatible.")
 parser.add_argument('npzs', nargs="+", help="list of npz files to be merged.")
+parser.add_argument('--codec', type=codec_type, default="deflate",
+                    help="the compression of the output: stored, deflate, deflate:1-9, bzip2, bzip2:1-9 or lzma. "
+                    +"The default is the same as np.savez_compressed. np.load reads any of them.")
+parser.add_argument('--jobs', type=int, default=1,
+                    help="the number of threads that decompress the inputs concurrently. "
+                    +"Up to this many input arrays are read ahead of the one being written, "
+                    +"so the memory usage grows with it. The output does not depend on it.")
 
-args = parser.parse_args()
+# the arrays copied from the first input. The arrays concatenated along the first axis
+# are archive.fields, and archive.optional_fields when all inputs have them.
+metadata = ["picsize", "patch_shape", "num_samples_per_state"]
 
-print("merging npzs")
-_images_mean = []
-_images_var = []
-_coords_mean = []
-_coords_var = []
-_transitions = []
 
-with np.load(args.npzs[0]) as data:
-    picsize               = data['picsize']
-    patch_shape           = data['patch_shape']
-    num_samples_per_state = data['num_samples_per_state']
+def lengths(npzs, headers):
+    """Returns the number of states to take from each input.
+The final state of an input with an odd number of states is discarded."""
+    result = []
+    for npz, header in zip(npzs, headers):
+        l = header["images_mean"][0][0]
+        if valid_length(l) != l:
+            print(f"{npz}: This run is terminated prematurely! number of images == {l} must be even. Discarding the final data point.")
+        result.append(valid_length(l))
+    return result
+
+
+def member_header(npzs, headers, name, ls):
+    "Returns the dtype and the shape of the concatenation of an array in the inputs."
+    (shape, dtype) = headers[0][name]
+    for npz, (other_shape, other_dtype) in zip(npzs, (header[name] for header in headers)):
+        if other_shape[1:] != shape[1:] or other_dtype != dtype:
+            raise ValueError("{}: {} has the shape {} and the dtype {}, while {} has {} and {}".format(
+                name, npz, other_shape, other_dtype, npzs[0], shape, dtype))
+    return dtype, (sum(ls), *shape[1:])
 
-count = 0
-for npz in tqdm.tqdm(args.npzs):
-    with np.load(npz) as data:
-        l = len(data["images_mean"])
-        if (l % 2) != 0:
-            print(f"This run is terminated prematurely! number of images == {l} must be even. Discarding the final data point.")
-            l -= 1
 
+def load(npz, name, l):
+    with np.load(npz) as data:
         # [:l] ignores the final data point when the dataset contains an odd number of elements
-        _images_mean.append(data["images_mean"][:l])
-        _images_var.append(data["images_var"][:l])
-        _coords_mean.append(data["coords_mean"][:l])
-        _coords_var.append(data["coords_var"][:l])
-        _transitions.append(data["transitions"][:l]+count) # shift the state id
-        count += l
-
-
-np.savez_compressed(args.out,
-                    images_mean=np.concatenate(_images_mean,axis=0),
-                    images_var=np.concatenate(_images_var,axis=0),
-                    coords_mean=np.concatenate(_coords_mean,axis=0),
-                    coords_var=np.concatenate(_coords_var,axis=0),
-                    picsize=picsize,
-                    patch_shape=patch_shape,
-                    num_samples_per_state=num_samples_per_state,
-                    transitions=np.concatenate(_transitions,axis=0))
-args.out.truncate()
+        return data[name][:l]
+
+
+def prefetch(pool, jobs, function, *iterables):
+    """Yields function(*args) for the arguments in order, while up to jobs calls run ahead in the pool.
+Without a pool, the calls are made one by one."""
+    if pool is None:
+        yield from map(function, *iterables)
+        return
+    futures = collections.deque()
+    for args in zip(*iterables):
+        if len(futures) >= jobs:
+            yield futures.popleft().result()
+        futures.append(pool.submit(function, *args))
+    while futures:
+        yield futures.popleft().result()
+
+
+def merge(out, npzs, jobs=1, codec="deflate"):
+    """Concatenate the inputs into out one array at a time, streaming into the zip container,
+so that only a single array of a single input is in memory at any time.
+With jobs > 1, the inputs are decompressed by a thread pool (zlib releases the GIL), while they are written in order."""
+    # the shapes are read from the .npy headers without decompressing the arrays
+    headers = [ array_headers(npz) for npz in npzs ]
+    ls = lengths(npzs, headers)
+    optional = []
+    for name in optional_fields:
+        missing = [ npz for npz, header in zip(npzs, headers) if name not in header ]
+        if not missing:
+            optional.append(name)
+        elif len(missing) < len(npzs):
+            print("{} is missing in {} of the {} inputs (e.g., {}); it is not merged.".format(
+                name, len(missing), len(npzs), missing[0]))
+    # all inputs are checked before the output is created, so that an incompatible input leaves no output
+    members = { name : member_header(npzs, headers, name, ls) for name in fields + optional }
+
+    # the output is written to a temporary file and renamed at the end, so that a failure leaves no partial archive
+    tmp = out + ".tmp"
+    try:
+        with NpzWriter(tmp, codec) as writer, \
+             (concurrent.futures.ThreadPoolExecutor(jobs) if jobs > 1 else contextlib.nullcontext()) as pool:
+            for name in fields + optional:
+                with writer.stream(name, *members[name]) as member:
+                    count = 0
+                    for array, l in zip(tqdm.tqdm(prefetch(pool, jobs, load, npzs, [name]*len(npzs), ls), total=len(npzs), desc=name), ls):
+                        if name == "transitions":
+                            array = array+count # shift the state id
+                        member.write(array)
+                        count += l
+
+            with np.load(npzs[0]) as data:
+                for name in metadata:
+                    writer.write(name, data[name])
+        os.replace(tmp, out)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    print("merging npzs")
+    merge(args.out, args.npzs, args.jobs, args.codec)
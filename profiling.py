@@ -0,0 +1,95 @@
+"""
+A lightweight profiler that accumulates the wall time, the number of items and the number of bytes of each stage of a pipeline,
+along with the peak resident set size of the process and its children.
+
+Example:
+
+    profile = Profile(enabled=True)
+    with profile.stage("decode", nbytes=os.path.getsize(path)):
+        image = imageio.imread(path)
+    profile.print_summary()
+    profile.save("profile.json")
+
+When disabled, stage() does nothing, so that the calls can stay in the code.
+"""
+
+import json
+import sys
+import time
+import resource
+import contextlib
+
+
+def maxrss_bytes(rusage):
+    "Returns the peak resident set size of a resource usage (see resource.getrusage and os.wait4) in bytes."
+    # ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+    return rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def peak_rss():
+    "Returns the peak resident set size in bytes of this process and of its (waited-for) children."
+    return (maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF)),
+            maxrss_bytes(resource.getrusage(resource.RUSAGE_CHILDREN)))
+
+
+class Profile(object):
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.stages = {}        # name -> [seconds, count, nbytes]
+        self.start = time.perf_counter()
+
+    def add(self, name, seconds=0.0, count=0, nbytes=0):
+        if not self.enabled:
+            return
+        record = self.stages.setdefault(name, [0.0, 0, 0])
+        record[0] += seconds
+        record[1] += count
+        record[2] += nbytes
+
+    @contextlib.contextmanager
+    def stage(self, name, count=1, nbytes=0):
+        "Time the enclosed block as a stage. The bytes processed can also be added later by add()."
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, count, nbytes)
+
+    def merge(self, stages):
+        "Add the stages recorded by another Profile, e.g., in a worker process."
+        for name, (seconds, count, nbytes) in stages.items():
+            self.add(name, seconds, count, nbytes)
+
+    def report(self):
+        rss_self, rss_children = peak_rss()
+        return {
+            "wall_seconds"           : time.perf_counter() - self.start,
+            "peak_rss_bytes"         : rss_self,
+            "peak_rss_children_bytes": rss_children,
+            "stages"                 : { name : { "seconds" : seconds, "count" : count, "bytes" : nbytes }
+                                         for name, (seconds, count, nbytes) in self.stages.items() },
+        }
+
+    def print_summary(self, file=sys.stdout):
+        report = self.report()
+        total = sum(stage["seconds"] for stage in report["stages"].values())
+        print("{:<16} {:>10} {:>7} {:>10} {:>12} {:>10}".format("stage", "time [s]", "%", "count", "MB", "MB/s"), file=file)
+        for name, stage in report["stages"].items():
+            print("{:<16} {:>10.3f} {:>7.1f} {:>10} {:>12.1f} {:>10.1f}".format(
+                name, stage["seconds"], 100 * stage["seconds"] / max(total, 1e-9), stage["count"],
+                stage["bytes"] / 2**20, stage["bytes"] / 2**20 / max(stage["seconds"], 1e-9)), file=file)
+        print("wall time: {:.3f} s (the stage times of the worker processes add up across processes)".format(
+            report["wall_seconds"]), file=file)
+        print("peak RSS: {:.1f} MB, children: {:.1f} MB".format(
+            report["peak_rss_bytes"] / 2**20, report["peak_rss_children_bytes"] / 2**20), file=file)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
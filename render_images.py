@@ -19,7 +19,8 @@ if INSIDE_BLENDER:
     import utils
     import blocks
     from blocks import State, Unstackable, load_colors
-    from render_utils import render_scene
+    from render_utils import render_scene, Session
+    from fingerprints import FingerprintIndex, transition_fingerprint
   except ImportError as e:
     print("\nERROR")
     print("Running render_images.py from Blender and cannot import utils.py.")
@@ -56,8 +57,22 @@ def initialize_parser():
   parser.add_argument('--num-steps', default=1, type=int,
                       help="The number of steps to perform from the source state")
 
+  parser.add_argument('--skip-duplicates', action="store_true",
+                      help="Do not render a transition whose logical pre and suc states (ignoring the jitter) were already rendered "
+                      +"by this job or by the other jobs sharing the same --fingerprint-dir, including those rendering concurrently. "
+                      +"The fingerprints of the rendered transitions are stored in a file per --start-idx range. "
+                      +"When 1000 transitions in a row are duplicates, e.g., all transitions of a small number of objects were rendered, "
+                      +"a warning is printed and the duplicates are rendered for the rest of the job.")
+  parser.add_argument('--fingerprint-dir', default=None,
+                      help="The directory of the fingerprints used by --skip-duplicates, default: OUTPUT_DIR/fingerprints. "
+                      +"The jobs that render into different output directories (e.g., the distributed mode of generate-dataset.sh) "
+                      +"must pass the same directory in order to skip the transitions rendered by each other.")
+
   # Rendering options
   blocks.initialize_parser_rendering_options(parser)
+  parser.add_argument('--session', action="store_true",
+                      help="Load the base scene and the materials once, and reset the scene between the images "
+                      +"instead of loading them for each image. The images are the same.")
 
   return parser
 
@@ -71,41 +86,65 @@ def path(dir,i,presuc,j,ext):
 
 
 def main(args):
-  import copy
   load_colors(args)
 
   os.makedirs(os.path.join(args.output_dir,"image_tr"), exist_ok=True)
   os.makedirs(os.path.join(args.output_dir,"scene_tr"), exist_ok=True)
 
+  if args.skip_duplicates:
+    index = FingerprintIndex(args.fingerprint_dir or os.path.join(args.output_dir,"fingerprints"),
+                             args.start_idx, args.start_idx+args.num_transitions)
+  # set when the duplicates can no longer be avoided
+  exhausted = False
+
+  session = Session(args) if args.session else None
+
   print("rendering images")
   for i in range(args.start_idx,
                  args.start_idx+args.num_transitions):
 
+    duplicates = 0
     while True:
       try:
         # by default, save the noiseless states into json.
         # if we want to extend the number of samples, load these fils and performs a wiggle.
+        # State.load also reads the base scenes in the format of State.dump, written by the older versions.
         if os.path.exists(path("scene_tr",i,"pre","---","json")):
           assert os.path.exists(path("scene_tr",i,"suc","---","json"))
           print("base scene available; loading scene")
           with open(path("scene_tr",i,"pre","---","json"),"r") as f:
-            pre = State.undump(json.load(f))
+            pre = State.load(json.load(f))
           with open(path("scene_tr",i,"suc","---","json"),"r") as f:
-            suc = State.undump(json.load(f))
+            suc = State.load(json.load(f))
+          if args.skip_duplicates and transition_fingerprint(pre,suc) not in index:
+            index.add(transition_fingerprint(pre,suc))
         else:
           assert not os.path.exists(path("scene_tr",i,"suc","---","json"))
           print("base scene not found; creating a new scene")
           pre = State(args)
-          suc = copy.deepcopy(pre)
+          suc = pre.clone()
           for j in range(args.num_steps):
             suc.random_action()
 
+          if args.skip_duplicates and not exhausted:
+            index.refresh()
+            if transition_fingerprint(pre,suc) in index:
+              duplicates += 1
+              if duplicates < 1000:
+                print("duplicate transition; creating another scene")
+                continue
+              print("warning: 1000 transitions in a row were duplicates; all transitions may have been rendered already. "
+                    +"The duplicates are rendered for the rest of this job.")
+              exhausted = True
+
           with open(path("scene_tr",i,"pre","---","json"),"w") as f:
-            json.dump(pre.dump(),f,indent=2)
+            json.dump(pre.to_record(),f,separators=(",",":"))
             f.truncate()
           with open(path("scene_tr",i,"suc","---","json"),"w") as f:
-            json.dump(suc.dump(),f,indent=2)
+            json.dump(suc.to_record(),f,separators=(",",":"))
             f.truncate()
+          if args.skip_duplicates:
+            index.add(transition_fingerprint(pre,suc))
           # print("dump success: ", json.dumps(pre.dump(),indent=2))
           # print("loading")
           # with open(path("scene_tr",i,"pre","---","json"),"r") as f:
@@ -116,26 +155,28 @@ def main(args):
           #
           # 1/0
 
+        # the jitter of a sample is drawn only when it is rendered, just before the camera and light jitters,
+        # so that the random sequence is the same as wiggling a copy of the state for each rendered sample
         for j in range(args.num_samples_per_state):
           if os.path.exists(path("image_tr",i,"pre",j,"png")):
             continue
-          state = copy.deepcopy(pre)
-          state.wiggle()
           render_scene(args,
                        output_image = path("image_tr",i,"pre",j,"png"),
                        output_scene = path("scene_tr",i,"pre",j,"json"),
-                       objects      = state.for_rendering())
+                       output_manifest = os.path.join(args.output_dir,"scene_tr.jsonl"),
+                       objects      = pre.wiggles(1)[0],
+                       session      = session)
 
         for j in range(args.num_samples_per_state):
           if os.path.exists(path("image_tr",i,"suc",j,"png")):
             continue
-          state = copy.deepcopy(suc)
-          state.wiggle()
           render_scene(args,
                        output_image = path("image_tr",i,"suc",j,"png"),
                        output_scene = path("scene_tr",i,"suc",j,"json"),
-                       objects      = state.for_rendering(),
-                       action       = state.last_action)
+                       output_manifest = os.path.join(args.output_dir,"scene_tr.jsonl"),
+                       objects      = suc.wiggles(1)[0],
+                       action       = suc.last_action,
+                       session      = session)
         break
       except Unstackable as e:
         print(e)
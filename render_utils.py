@@ -23,14 +23,11 @@ if INSIDE_BLENDER:
     sys.exit(1)
 
 
-def render_scene(args,
-    output_image='render.png',
-    output_scene='render_json',
-    output_blendfile=None,
-    objects=[],
-    **kwargs
-  ):
-
+def setup_scene(args):
+  """
+  Load the base scene and the materials, and apply the render settings
+  other than the output path.
+  """
   # Load the main blendfile
   bpy.ops.wm.open_mainfile(filepath=args.base_scene_blendfile)
 
@@ -42,7 +39,6 @@ def render_scene(args,
   # cannot be used.
   render_args = bpy.context.scene.render
   render_args.engine = "CYCLES"
-  render_args.filepath = output_image
   render_args.resolution_x = args.width
   render_args.resolution_y = args.height
   render_args.resolution_percentage = 100
@@ -66,32 +62,20 @@ def render_scene(args,
   if args.use_gpu == 1:
     bpy.context.scene.cycles.device = 'GPU'
 
-  # This will give ground-truth information about the scene and its objects
-  scene_struct = {
-      'image_filename': os.path.basename(output_image),
-      'objects': [],
-      'directions': {},
-  }
-  scene_struct.update(kwargs)
 
+def add_plane():
   if bpy.app.version < (2, 80, 0):
     bpy.ops.mesh.primitive_plane_add(radius=5)
   else:
     bpy.ops.mesh.primitive_plane_add(size=5)
+  return bpy.context.object
 
-  plane = bpy.context.object
 
-  def rand(L):
-    return 2.0 * L * (random.random() - 0.5)
-
-  # Add random jitter to camera position
-  if args.camera_jitter > 0:
-    for i in range(3):
-      bpy.data.objects['Camera'].location[i] += rand(args.camera_jitter)
-
-  # Figure out the left, up, and behind directions along the plane and record
-  # them in the scene structure
-  camera = bpy.data.objects['Camera']
+def plane_directions(camera, plane):
+  """
+  Figure out the left, up, and behind directions along the plane seen from the camera,
+  and return all six axis-aligned directions. The plane is deleted.
+  """
   plane_normal = plane.data.vertices[0].normal
   if bpy.app.version < (2, 80, 0):
     cam_behind = camera.matrix_world.to_quaternion() * Vector((0, 0, -1))
@@ -109,13 +93,114 @@ def render_scene(args,
   # contains the actual ground plane.
   utils.delete_object(plane)
 
+  return {
+    'behind' : tuple(plane_behind),
+    'front'  : tuple(-plane_behind),
+    'left'   : tuple(plane_left),
+    'right'  : tuple(-plane_left),
+    'above'  : tuple(plane_up),
+    'below'  : tuple(-plane_up),
+  }
+
+
+class Session(object):
+  """
+  Keeps the base scene loaded between the images rendered by render_scene,
+  instead of loading the base scene and the materials for each image.
+
+  The names of the objects, the meshes and the materials in the base scene and
+  the locations of the camera and the lamps are recorded once. reset() removes
+  the blocks and anything else added since then, and restores the jittered locations.
+  The shapes are appended once into a utils.ShapeCache and the materials are built once
+  into a utils.MaterialCache, which are kept by reset().
+
+  The rendered scene is the same as the one freshly loaded. The blocks get the same names
+  as after a fresh load, since the counters of the ShapeCache are reset. The materials do not:
+  a cached material is named Material_<name>_<k> after the order in which it was built,
+  while add_material without a cache names it after the number of materials in the scene.
+  The names do not appear in the images nor in the scene json files.
+  """
+  # the objects jittered by render_scene
+  jittered = ('Camera', 'Lamp_Key', 'Lamp_Back', 'Lamp_Fill')
+
+  def __init__(self, args):
+    setup_scene(args)
+    self.object_names   = set(o.name for o in bpy.data.objects)
+    self.mesh_names     = set(m.name for m in bpy.data.meshes)
+    self.material_names = set(m.name for m in bpy.data.materials)
+    self.locations      = { name : tuple(bpy.data.objects[name].location) for name in Session.jittered }
+    # the directions along the plane, which do not change unless the camera is jittered
+    self.directions     = None
+    self.shapes         = utils.ShapeCache()
+    self.materials      = utils.MaterialCache()
+
+  def reset(self):
+    templates = self.shapes.templates.values()
+    materials = self.materials.materials.values()
+    # the objects are removed first, so that their meshes and materials have no users
+    for collection, names in ((bpy.data.objects,   self.object_names   | set(o.name for o in templates)),
+                              (bpy.data.meshes,    self.mesh_names     | set(o.data.name for o in templates)),
+                              (bpy.data.materials, self.material_names | set(m.name for m in materials))):
+      for datablock in list(collection):
+        if datablock.name not in names:
+          # do_unlink is False by default before Blender 2.79, where removing a linked object raises an error
+          collection.remove(datablock, do_unlink=True)
+    for name, location in self.locations.items():
+      bpy.data.objects[name].location = location
+    self.shapes.reset()
+
+
+def render_scene(args,
+    output_image='render.png',
+    output_scene='render_json',
+    output_blendfile=None,
+    output_manifest=None,
+    objects=[],
+    session=None,
+    **kwargs
+  ):
+  """
+  Render the objects into output_image. With a Session, the scene is reset to the base scene
+  instead of being loaded again.
+  """
+  if session is None:
+    setup_scene(args)
+  else:
+    session.reset()
+  bpy.context.scene.render.filepath = output_image
+
+  # This will give ground-truth information about the scene and its objects
+  scene_struct = {
+      'image_filename': os.path.basename(output_image),
+      'objects': [],
+      'directions': {},
+  }
+  scene_struct.update(kwargs)
+
+  # the directions along the plane do not change unless the camera is jittered
+  cached = session is not None and session.directions is not None
+  if not cached:
+    plane = add_plane()
+
+  def rand(L):
+    return 2.0 * L * (random.random() - 0.5)
+
+  # Add random jitter to camera position
+  if args.camera_jitter > 0:
+    for i in range(3):
+      bpy.data.objects['Camera'].location[i] += rand(args.camera_jitter)
+
+  # Record the directions along the plane in the scene structure
+  camera = bpy.data.objects['Camera']
+  if cached:
+    directions = session.directions
+  else:
+    directions = plane_directions(camera, plane)
+    if session is not None and args.camera_jitter == 0:
+      session.directions = directions
+
   # Save all six axis-aligned directions in the scene struct
-  scene_struct['directions']['behind'] = tuple(plane_behind)
-  scene_struct['directions']['front'] = tuple(-plane_behind)
-  scene_struct['directions']['left'] = tuple(plane_left)
-  scene_struct['directions']['right'] = tuple(-plane_left)
-  scene_struct['directions']['above'] = tuple(plane_up)
-  scene_struct['directions']['below'] = tuple(-plane_up)
+  scene_struct['directions'].update(directions)
 
   # Add random jitter to lamp positions
   if args.key_light_jitter > 0:
@@ -129,7 +214,11 @@ def render_scene(args,
       bpy.data.objects['Lamp_Fill'].location[i] += rand(args.fill_light_jitter)
 
   # Now make some random objects
-  blender_objects = add_objects(args, scene_struct, camera, objects)
+  if session is not None:
+    blender_objects = add_objects(args, scene_struct, camera, objects,
+                                  shapes=session.shapes, materials=session.materials)
+  else:
+    blender_objects = add_objects(args, scene_struct, camera, objects)
 
   # Render the scene and dump the scene data structure
   scene_struct['objects'] = objects
@@ -145,13 +234,20 @@ def render_scene(args,
     json.dump(scene_struct, f, indent=2)
     f.truncate()
 
+  # Append the scene to the manifest, one scene per line, so that the scenes of a job
+  # can be read sequentially without opening each file
+  if output_manifest is not None:
+    with open(output_manifest, 'a') as f:
+      f.write(json.dumps(scene_struct) + '\n')
+
   if output_blendfile is not None:
     bpy.ops.wm.save_as_mainfile(filepath=output_blendfile)
 
 
-def add_objects(args, scene_struct, camera, objects):
+def add_objects(args, scene_struct, camera, objects, shapes=None, materials=None):
   """
-  Add objects to the current blender scene
+  Add objects to the current blender scene.
+  shapes and materials are an optional utils.ShapeCache and utils.MaterialCache.
   """
   blender_objects = []
   for obj in objects:
@@ -161,10 +257,11 @@ def add_objects(args, scene_struct, camera, objects):
                      obj["shape"],
                      obj["size"],
                      obj["location"],
-                     theta=obj["rotation"])
+                     theta=obj["rotation"],
+                     shapes=shapes)
     bobj = bpy.context.object
     blender_objects.append(bobj)
-    utils.add_material(obj["material"], Color=obj["color"])
+    utils.add_material(obj["material"], materials=materials, Color=obj["color"])
     obj["pixel_coords"] = utils.get_camera_coords(camera, bobj.location)
 
     loc = np.array(bobj.location)
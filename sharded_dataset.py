@@ -0,0 +1,114 @@
+"""
+A read-only view of several dataset archives (e.g., the outputs of the jobs of generate-dataset.sh)
+as a single dataset, without merging them with merge-npz.py.
+
+The states of the shards are concatenated in the given order, and the final state of a shard
+with an odd number of states is discarded, as merge-npz.py does. The transitions are shifted
+by the number of states in the preceding shards, so that every field has the same contents as in the merged archive.
+
+Example:
+
+    dataset = ShardedDataset(glob.glob("blocks-3-3/*-objs.npz"))
+    len(dataset)                        # -> the number of states
+    dataset["images_mean"][5]           # -> ndarray
+    dataset["images_mean"][5:10]
+    dataset["transitions"][:]
+    dataset["picsize"]                  # -> the metadata of the first shard
+
+A shard is decompressed when its item is first accessed, one field at a time.
+The decompressed fields are kept in an LRU cache of cache_size entries.
+"""
+
+import numpy as np
+import collections
+
+from archive import array_headers, valid_length, fields, optional_fields
+from views import RowView
+
+
+class ShardedDataset(object):
+
+    def __init__(self, paths, cache_size=4):
+        assert len(paths) > 0, "no shard is given"
+        self.paths      = list(paths)
+        self.cache_size = cache_size
+        self._cache     = collections.OrderedDict() # (shard, field) -> ndarray
+
+        # the lengths and the shapes are read from the .npy headers without decompressing the arrays
+        headers = [ array_headers(path) for path in self.paths ]
+        self.lengths = np.array([ valid_length(header["images_mean"][0][0]) for header in headers ], dtype=int)
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        self.fields  = {}
+        for name in fields + [ name for name in optional_fields if all(name in header for header in headers) ]:
+            (shape, dtype) = headers[0][name]
+            for path, header in zip(self.paths, headers):
+                if header[name][0][1:] != shape[1:] or header[name][1] != dtype:
+                    raise ValueError("{}: {} has the shape {} and the dtype {}, while {} has {} and {}".format(
+                        name, path, header[name][0], header[name][1], self.paths[0], shape, dtype))
+            self.fields[name] = (dtype, shape[1:])
+        self.metadata = {}
+        with np.load(self.paths[0]) as data:
+            for name in data.files:
+                if name not in fields and name not in optional_fields:
+                    self.metadata[name] = data[name]
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, name):
+        if name in self.fields:
+            return ShardedArray(self, name)
+        return self.metadata[name]
+
+    def __contains__(self, name):
+        return name in self.fields or name in self.metadata
+
+    def _shard(self, shard, name):
+        "Returns a field of a shard, truncated to the valid length, decompressing it unless it is cached."
+        key = (shard, name)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+        else:
+            with np.load(self.paths[shard]) as data:
+                self._cache[key] = data[name][:self.lengths[shard]]
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return self._cache[key]
+
+    def _items(self, shard, name, index):
+        "Returns the items of a field of a shard at the index (an int or a slice) relative to the shard."
+        items = self._shard(shard, name)[index]
+        if name == "transitions":
+            # shift the state id. Only the returned items are copied.
+            # transition_ids refer to the rendered transitions, which are not shifted.
+            # The offsets are int64, thus the sum is cast back to the dtype of the field, as merge-npz.py stores it.
+            items = (items + self.offsets[shard]).astype(self.fields[name][0])
+        return items
+
+
+class ShardedArray(RowView):
+    "A read-only view of a field in a ShardedDataset. See views.RowView for the supported indexing."
+
+    def __init__(self, dataset, name):
+        self.dataset = dataset
+        self.name    = name
+        self.dtype, item_shape = dataset.fields[name]
+        self.shape   = (len(dataset), *item_shape)
+
+    def _rows(self, start, stop):
+        offsets = self.dataset.offsets
+        first = np.searchsorted(offsets, start, side="right") - 1
+        last  = np.searchsorted(offsets, stop,  side="left")  - 1
+        parts = [ self.dataset._items(shard, self.name, slice(max(start, offsets[shard]) - offsets[shard],
+                                                               min(stop, offsets[shard+1]) - offsets[shard]))
+                  for shard in range(first, last+1)
+                  if offsets[shard] < offsets[shard+1] ]
+        if len(parts) == 1:
+            # a view of a single shard does not copy the data
+            return parts[0]
+        return np.concatenate(parts)
+
+    def _row(self, i):
+        offsets = self.dataset.offsets
+        shard = np.searchsorted(offsets, i, side="right") - 1
+        return self.dataset._items(shard, self.name, i - offsets[shard])
@@ -0,0 +1,192 @@
+"""
+Enumerate all states reachable from a State by action_move, and export the transition graph.
+
+A logical state is encoded by the support of each block: support[i] is the index of the block
+on which the i-th block is placed, or num_objects + c when it is on the table at the column c.
+This is independent of the jitter and the exact coordinates, and the supports of all blocks
+are packed into a single uint64 key (ceil(log2(num_objects + table_size)) bits per block).
+
+The successors follow the rules of State.shuffle1 with force_change=True:
+a top block moves to the top of another column whose top block is stackable, or to an empty column,
+except that a block on the table cannot move to an empty column (its object below does not change).
+
+The graph is explored in breadth-first order, a batch of states at a time with vectorized numpy operations.
+Only the sorted keys of the visited states and their ids (12 bytes per state) and the frontier are kept in memory,
+which peaks at a few tens of bytes per state while they are merged.
+The states and the edges are written to temporary files as they are found, and then streamed into the npz:
+
+    states    : (N, num_objects) uint8, the supports. The state 0 is the initial state.
+    keys      : (N,) uint64, the packed supports.
+    edges     : (E, 2) uint32, the source and the destination states.
+    actions   : (E, 2) uint8, the moved block and the destination column.
+    stackable : (num_objects,) bool
+    table_size, num_objects
+
+Usage (outside Blender): python3 state_space.py --num-objects 4 --table-size 4 --out graph.npz
+"""
+
+import os
+import random
+import argparse
+import tempfile
+import numpy as np
+
+import blocks
+from blocks import State, load_colors
+from archive import NpzWriter, codec_type
+
+
+def key_bits(num_objects, table_size):
+  bits = int(np.ceil(np.log2(num_objects + table_size)))
+  if bits * num_objects > 64:
+    raise ValueError("{} objects on {} columns do not fit in a 64 bit key".format(num_objects, table_size))
+  return bits
+
+
+def encode(supports, bits):
+  "packs the supports (m, num_objects) into keys (m,)."
+  supports = np.asarray(supports, dtype=np.uint64)
+  shifts = np.arange(supports.shape[1], dtype=np.uint64) * np.uint64(bits)
+  return np.bitwise_or.reduce(supports << shifts, axis=1)
+
+
+def decode(keys, num_objects, bits):
+  "unpacks the keys (m,) into the supports (m, num_objects)."
+  shifts = np.arange(num_objects, dtype=np.uint64) * np.uint64(bits)
+  return ((np.asarray(keys, dtype=np.uint64)[:,None] >> shifts) & np.uint64((1 << bits) - 1)).astype(np.int64)
+
+
+def supports_of(state):
+  "returns the supports of a State."
+  n = len(state.objects)
+  supports = np.zeros(n, dtype=np.int64)
+  for i, o in enumerate(state.objects):
+    below = state.object_just_below(o)
+    supports[i] = below._i if below is not None else n + state.column[i]
+  return supports
+
+
+def successors(supports, stackable, table_size):
+  """returns the successors of a batch of states (m, num_objects) as (source, block, column, supports),
+where source is the index of the state in the batch."""
+  m, n = supports.shape
+  rows = np.arange(m)[:,None]
+  supported = np.zeros((m, n + table_size), dtype=bool)
+  supported[rows, supports] = True
+  is_top = ~supported[:,:n]
+  # the column of each block, following the supports down to the table
+  base = supports.copy()
+  for _ in range(n):
+    on_block = base < n
+    if not on_block.any():
+      break
+    base = np.where(on_block, np.take_along_axis(supports, np.minimum(base, n-1), axis=1), base)
+  column = base - n
+  # the top block of each column, or -1 when it is empty
+  top = np.full((m, table_size), -1)
+  r, i = np.nonzero(is_top)
+  top[r, column[r,i]] = i
+
+  target = top[:,None,:]                                          # (m, 1, table_size)
+  ok = is_top[:,:,None] & (column[:,:,None] != np.arange(table_size))
+  ok &= np.where(target >= 0, stackable[np.maximum(target, 0)], True)
+  # a block on the table moved to an empty column keeps the same (no) object below
+  ok &= (target >= 0) | (supports[:,:,None] < n)
+  source, block, col = np.nonzero(ok)
+  result = supports[source].copy()
+  result[np.arange(len(source)), block] = np.where(top[source, col] >= 0, top[source, col], n + col)
+  return source, block, col, result
+
+
+def enumerate_states(state, out, batch_size=10000, max_states=None, codec="deflate:1", verbose=True):
+  """explores the states reachable from state and writes the graph to out (an npz).
+Returns the number of states and edges."""
+  n, table_size = len(state.objects), state.table_size
+  bits = key_bits(n, table_size)
+  stackable = state.stackable.copy()
+
+  initial = encode(supports_of(state)[None], bits)
+  keys, ids = initial, np.zeros(1, dtype=np.uint32)    # the visited keys, sorted, and their ids
+  frontier = initial
+  num_states, num_edges = 1, 0
+  with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out))) as tmp:
+    files = { name : open(os.path.join(tmp, name), "wb") for name in ("states", "edges", "actions") }
+    decode(initial, n, bits).astype(np.uint8).tofile(files["states"])
+    depth = 0
+    while len(frontier) > 0 and (max_states is None or num_states < max_states):
+      if verbose:
+        print("depth {}: {} states, {} in the frontier".format(depth, num_states, len(frontier)))
+      next_frontier = []
+      for start in range(0, len(frontier), batch_size):
+        batch = frontier[start:start+batch_size]
+        source, block, col, result = successors(decode(batch, n, bits), stackable, table_size)
+        result_keys = encode(result, bits)
+
+        # register the new states in the order of their keys
+        unique = np.unique(result_keys)
+        pos = np.minimum(np.searchsorted(keys, unique), len(keys)-1)
+        new = unique[keys[pos] != unique]
+        new_ids = np.arange(num_states, num_states + len(new), dtype=np.uint32)
+        decode(new, n, bits).astype(np.uint8).tofile(files["states"])
+        num_states += len(new)
+        next_frontier.append(new)
+        # new is sorted, so it is merged in linear time
+        at = np.searchsorted(keys, new)
+        keys = np.insert(keys, at, new)
+        ids  = np.insert(ids, at, new_ids)
+
+        source_ids = ids[np.searchsorted(keys, batch)][source]
+        dest_ids   = ids[np.searchsorted(keys, result_keys)]
+        np.stack((source_ids, dest_ids), axis=1).astype(np.uint32).tofile(files["edges"])
+        np.stack((block, col), axis=1).astype(np.uint8).tofile(files["actions"])
+        num_edges += len(source)
+      frontier = np.concatenate(next_frontier)
+      depth += 1
+
+    for f in files.values():
+      f.close()
+    if verbose:
+      print("{} states, {} edges".format(num_states, num_edges))
+
+    # the temporary files are read in chunks, rather than mapped, so that they are not kept in memory
+    chunk = 2**20
+    with NpzWriter(out, codec) as writer:
+      for name, dtype, width in (("states", np.uint8, n), ("edges", np.uint32, 2), ("actions", np.uint8, 2)):
+        rows = num_states if name == "states" else num_edges
+        with writer.stream(name, dtype, (rows, width)) as member, open(os.path.join(tmp, name), "rb") as f:
+          for start in range(0, rows, chunk):
+            member.write(np.fromfile(f, dtype=dtype, count=min(chunk, rows-start)*width).reshape((-1, width)))
+      # encode() makes uint64 copies of the supports, thus smaller chunks
+      with writer.stream("keys", np.uint64, (num_states,)) as member, open(os.path.join(tmp, "states"), "rb") as f:
+        for start in range(0, num_states, chunk // 16):
+          member.write(encode(np.fromfile(f, dtype=np.uint8, count=min(chunk // 16, num_states-start)*n).reshape((-1, n)), bits))
+      writer.write("stackable", stackable)
+      writer.write("table_size", table_size)
+      writer.write("num_objects", n)
+  return num_states, num_edges
+
+
+def initialize_parser():
+  parser = argparse.ArgumentParser(
+    description='enumerate the states reachable from a random state and export the transition graph.')
+  blocks.initialize_parser_input_options(parser)
+  blocks.initialize_parser_environment_options(parser)
+  parser.add_argument('--seed', default=None, type=int,
+                      help="the random seed of the initial state.")
+  parser.add_argument('--out', default='graph.npz',
+                      help="the output npz file.")
+  parser.add_argument('--max-states', default=None, type=int,
+                      help="stop after the depth at which the number of states exceeds this.")
+  parser.add_argument('--batch-size', default=10000, type=int,
+                      help="the number of states whose successors are computed at once.")
+  parser.add_argument('--codec', type=codec_type, default="deflate:1",
+                      help="the compression of the output, see archive.parse_codec. "
+                      +"The edges of a large graph take long to compress at the higher levels.")
+  return parser
+
+
+if __name__ == '__main__':
+  args = initialize_parser().parse_args()
+  random.seed(args.seed)
+  load_colors(args)
+  enumerate_states(State(args), args.out, args.batch_size, args.max_states, args.codec)
@@ -0,0 +1,44 @@
+"""
+Tests of chunked_store.ChunkedStore: the items appended in batches that do not align with the chunks
+are read back after the store is reopened. Run with: python -m pytest tests
+"""
+
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunked_store import ChunkedStore
+
+
+def test_append_and_read(tmp_path):
+    path = str(tmp_path / "store")
+    store = ChunkedStore.create(path, chunk_size=3, metadata={"picsize": [20, 30, 3]})
+    rng = np.random.default_rng(0)
+    batches = []
+    for n in (2, 4, 1, 0, 3):
+        batch = dict(images_mean=rng.integers(0, 256, (n, 2, 4, 4, 3)).astype(np.uint8),
+                     transitions=np.arange(len(store), len(store)+n, dtype=np.uint32))
+        store.append(**batch)
+        batches.append(batch)
+
+    expected = { name : np.concatenate([ batch[name] for batch in batches ]) for name in batches[0] }
+    store = ChunkedStore(path)
+    assert len(store) == 10
+    np.testing.assert_array_equal(store.metadata["picsize"], [20, 30, 3])
+    for name, array in expected.items():
+        assert store[name].dtype == array.dtype
+        assert store[name].shape == array.shape
+        np.testing.assert_array_equal(store[name][:], array)
+        np.testing.assert_array_equal(store[name][::-1], array[::-1])
+        np.testing.assert_array_equal(store[name][8:1:-2], array[8:1:-2])
+        np.testing.assert_array_equal(store[name][2:7], array[2:7])
+        for i in range(len(array)):
+            np.testing.assert_array_equal(store[name][i], array[i])
+
+    # appending to the reopened store continues after the existing items
+    store.append(images_mean=np.zeros((2, 2, 4, 4, 3), dtype=np.uint8),
+                 transitions=np.array([10, 11], dtype=np.uint32))
+    store = ChunkedStore(path)
+    np.testing.assert_array_equal(store["transitions"][:], np.arange(12))
+    np.testing.assert_array_equal(store["images_mean"][:10], expected["images_mean"])
@@ -0,0 +1,216 @@
+"""
+Tests of render_utils.Session against a stub of the bpy module of Blender 2.78,
+which stands in for the part of the datablock API used by Session, utils.ShapeCache
+and utils.MaterialCache. Run with: python -m pytest tests
+"""
+
+import os, sys, types
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+base_objects = ['Camera', 'Lamp_Key', 'Lamp_Back', 'Lamp_Fill', 'Ground']
+
+
+class Collection(list):
+  """ bpy.data.objects etc., looked up by name """
+  def __getitem__(self, key):
+    if isinstance(key, str):
+      for datablock in self:
+        if datablock.name == key:
+          return datablock
+      raise KeyError(key)
+    return list.__getitem__(self, key)
+
+  def remove(self, datablock, do_unlink=False):
+    # as in Blender < 2.79, an object still linked to a scene cannot be removed by default
+    if datablock in scene.objects and not do_unlink:
+      raise RuntimeError('%s must have zero users to be removed' % datablock.name)
+    if datablock in scene.objects:
+      scene.objects.unlink(datablock)
+    list.remove(self, datablock)
+
+
+class SceneObjects(Collection):
+  def link(self, obj):
+    self.append(obj)
+
+  def unlink(self, obj):
+    list.remove(self, obj)
+
+
+class Socket(object):
+  def __init__(self, name):
+    self.name = name
+    self.default_value = None
+
+
+class Node(object):
+  def __init__(self, name, inputs=()):
+    self.name = name
+    self.inputs = Collection(Socket(i) for i in inputs)
+    self.outputs = Collection([Socket('Shader')])
+    self.node_tree = None
+
+
+class Nodes(Collection):
+  def new(self, kind):
+    node = Node(kind, ['Color'])
+    self.append(node)
+    return node
+
+
+class Material(object):
+  def __init__(self, name):
+    self.name = name
+    self.use_nodes = False
+    self.node_tree = types.SimpleNamespace(nodes=Nodes([Node('Material Output', ['Surface'])]),
+                                           links=types.SimpleNamespace(new=lambda a, b: None))
+
+
+class Materials(Collection):
+  def new(self, name):
+    mat = Material(name)
+    self.append(mat)
+    return mat
+
+
+class Mesh(object):
+  def __init__(self, name):
+    self.name = name
+    self.materials = []
+
+
+class Slot(object):
+  def __init__(self):
+    self.link = 'DATA'
+    self.material = None
+
+
+class Object(object):
+  def __init__(self, name, mesh=None, location=(0., 0., 0.)):
+    self.name = name
+    self.data = mesh
+    self.location = location
+    self.scale = [1., 1., 1.]
+    self.rotation_euler = [0., 0., 0.]
+    self.material_slots = []
+
+  location = property(lambda self: self._location,
+                      lambda self, value: setattr(self, '_location', list(value)))
+
+  def copy(self):
+    obj = Object(self.name + '.001', self.data, self.location)
+    obj.scale = list(self.scale)
+    obj.material_slots = [Slot() for _ in self.data.materials]
+    data.objects.append(obj)
+    return obj
+
+
+def open_mainfile(filepath):
+  data.objects[:] = [Object(name, None, (i, 2., 3.)) for i, name in enumerate(base_objects)]
+  data.meshes[:] = [Mesh('Ground')]
+  data.materials[:] = [Material('Base')]
+  scene.objects[:] = list(data.objects)
+
+
+def append(filename):
+  name = filename.split('/')[-1]
+  if '/NodeTree/' in filename:
+    data.node_groups[name] = name
+  else:
+    mesh = Mesh(name)
+    obj = Object(name, mesh)
+    data.meshes.append(mesh)
+    data.objects.append(obj)
+    scene.objects.link(obj)
+
+
+def transform_resize(value):
+  scene.objects.active.scale = list(value)
+
+def transform_translate(value):
+  obj = scene.objects.active
+  obj.location = [l + d for l, d in zip(obj.location, value)]
+
+
+data = types.SimpleNamespace(objects=Collection(), meshes=Collection(), materials=Materials(), node_groups={})
+scene = types.SimpleNamespace(objects=SceneObjects(), update=lambda: None)
+scene.objects.active = None
+
+
+@pytest.fixture
+def bpy(monkeypatch):
+  module = types.ModuleType('bpy')
+  module.data = data
+  module.app = types.SimpleNamespace(version=(2, 78, 0))
+  module.ops = types.SimpleNamespace(
+    wm=types.SimpleNamespace(open_mainfile=open_mainfile, append=append),
+    transform=types.SimpleNamespace(resize=transform_resize, translate=transform_translate))
+  class Context(object):
+    scene = globals()['scene']
+    object = active_object = property(lambda self: scene.objects.active)
+  module.context = Context()
+  mathutils = types.ModuleType('mathutils')
+  mathutils.Vector = tuple
+  monkeypatch.setitem(sys.modules, 'bpy', module)
+  monkeypatch.setitem(sys.modules, 'bpy_extras', types.ModuleType('bpy_extras'))
+  monkeypatch.setitem(sys.modules, 'mathutils', mathutils)
+  for name in ('utils', 'render_utils'):
+    monkeypatch.delitem(sys.modules, name, raising=False)
+  data.node_groups.clear()
+  return module
+
+
+@pytest.fixture
+def session(bpy, tmp_path, monkeypatch):
+  import render_utils
+  for name in ('Rubber', 'MyMetal'):
+    (tmp_path / ('%s.blend' % name)).touch()
+  def setup_scene(args):
+    open_mainfile(None)
+    render_utils.utils.load_materials(str(tmp_path))
+  monkeypatch.setattr(render_utils, 'setup_scene', setup_scene)
+  return render_utils.Session(None)
+
+
+def add_blocks(utils, shapes=None, materials=None):
+  for shape, material, color in (('SmoothCube_v2',  'MyMetal', (1., 0., 0., 1.)),
+                                 ('SmoothCylinder', 'Rubber',  [0.1, 0.2, 0.3, 1.]),
+                                 ('SmoothCube_v2',  'MyMetal', (1., 0., 0., 1.))):
+    utils.add_object('shapes', shape, 0.5, (1., 0., 0.5), theta=3, shapes=shapes)
+    utils.add_material(material, materials=materials, Color=color)
+
+
+def blocks():
+  return sorted((o.name, tuple(o.location), tuple(o.scale), o.rotation_euler[2])
+                for o in scene.objects if o.name not in base_objects)
+
+
+def test_reset_restores_the_base_scene(session):
+  import utils
+  templates = ['SmoothCube_v2', 'SmoothCylinder']
+  for i in range(3):
+    for name in session.jittered:
+      data.objects[name].location = (10. * i, 0., 0.)
+    add_blocks(utils, session.shapes, session.materials)
+    session.reset()
+    assert sorted(o.name for o in scene.objects) == sorted(base_objects)
+    assert sorted(o.name for o in data.objects) == sorted(base_objects + templates)
+    assert sorted(m.name for m in data.meshes) == sorted(['Ground'] + templates)
+    assert [o.location for o in data.objects if o.name in base_objects] == \
+      [[i, 2., 3.] for i in range(len(base_objects))]
+  # the cached materials are built once, and kept by reset
+  assert sorted(m.name for m in data.materials) == ['Base', 'Material_MyMetal_0', 'Material_Rubber_1']
+
+
+def test_blocks_match_a_fresh_load(session):
+  import utils
+  cached = []
+  for i in range(2):
+    add_blocks(utils, session.shapes, session.materials)
+    cached.append(blocks())
+    session.reset()
+  open_mainfile(None)
+  add_blocks(utils)
+  assert cached[0] == cached[1] == blocks()
@@ -0,0 +1,71 @@
+"""
+Tests of sharded_dataset.ShardedDataset against the archive merged by merge-npz.py,
+for shards with odd numbers of states. Run with: python -m pytest tests
+"""
+
+import os, sys
+import subprocess
+import numpy as np
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from archive import savez
+from sharded_dataset import ShardedDataset
+
+
+def write_shard(path, rng, n, transition_ids=True):
+    arrays = dict(images_mean=rng.integers(0, 256, (n, 3, 2, 2, 3)).astype(np.uint8),
+                  images_var=rng.integers(0, 2**16, (n, 3, 2, 2, 3)).astype(np.uint16),
+                  coords_mean=rng.integers(0, 300, (n, 3, 4)).astype(np.uint16),
+                  coords_var=rng.integers(0, 300, (n, 3, 4)).astype(np.uint32),
+                  transitions=np.arange(n, dtype=np.uint32),
+                  picsize=np.array([20, 30, 3]),
+                  patch_shape=np.array([2, 2, 3]),
+                  num_samples_per_state=np.array(5))
+    if transition_ids:
+        arrays["transition_ids"] = np.repeat(rng.permutation(1000)[:(n+1)//2], 2)[:n].astype(np.uint32)
+    savez(str(path), **arrays)
+    return str(path)
+
+
+def merge(tmp_path, shards):
+    out = str(tmp_path / "merged.npz")
+    subprocess.run([sys.executable, os.path.join(root, "merge-npz.py"), "--out", out, *shards],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return np.load(out)
+
+
+@pytest.mark.parametrize("lengths", [(5, 4, 7), (1, 6), (3,)])
+def test_same_as_merged(tmp_path, lengths):
+    rng = np.random.default_rng(len(lengths))
+    shards = [ write_shard(tmp_path / "{}.npz".format(k), rng, n) for k, n in enumerate(lengths) ]
+    with merge(tmp_path, shards) as merged:
+        dataset = ShardedDataset(shards, cache_size=2)
+        assert len(dataset) == len(merged["images_mean"])
+        for name in ("images_mean", "images_var", "coords_mean", "coords_var", "transitions", "transition_ids"):
+            expected = merged[name]
+            array = dataset[name]
+            assert array.dtype == expected.dtype, name
+            assert array.shape == expected.shape, name
+            for key in (slice(None), slice(None, None, -1), slice(6, 1, -2), slice(3, 9), slice(-4, None)):
+                result = array[key]
+                assert result.dtype == expected.dtype, (name, key)
+                np.testing.assert_array_equal(result, expected[key])
+            for i in range(len(expected)):
+                assert array[i].dtype == expected.dtype, (name, i)
+                np.testing.assert_array_equal(array[i], expected[i])
+        for name in ("picsize", "patch_shape", "num_samples_per_state"):
+            np.testing.assert_array_equal(dataset[name], merged[name])
+
+
+def test_optional_fields(tmp_path):
+    rng = np.random.default_rng(0)
+    shards = [ write_shard(tmp_path / "0.npz", rng, 4),
+               write_shard(tmp_path / "1.npz", rng, 6, transition_ids=False) ]
+    with merge(tmp_path, shards) as merged:
+        dataset = ShardedDataset(shards)
+        assert "transition_ids" not in merged.files
+        assert "transition_ids" not in dataset
+        np.testing.assert_array_equal(dataset["transitions"][:], merged["transitions"])
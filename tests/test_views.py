@@ -0,0 +1,76 @@
+"""
+Tests of views.forward_slice and views.RowView, compared with the indexing of a numpy array.
+Run with: python -m pytest tests
+"""
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from views import RowView, forward_slice
+
+
+class Parts(RowView):
+    "A RowView of the concatenation of several arrays."
+
+    def __init__(self, parts):
+        self.parts  = parts
+        self.name   = "parts"
+        self.dtype  = parts[0].dtype
+        self.shape  = (sum(len(part) for part in parts), *parts[0].shape[1:])
+        self.array  = np.concatenate(parts)
+
+    def _rows(self, start, stop):
+        assert 0 <= start < stop <= len(self)
+        return self.array[start:stop]
+
+    def _row(self, i):
+        assert 0 <= i < len(self)
+        return self.array[i]
+
+
+@pytest.fixture
+def view():
+    array = np.arange(10 * 2).reshape((10, 2)).astype(np.uint16)
+    return Parts([array[:3], array[3:4], array[4:10]])
+
+
+slices = [ slice(start, stop, step)
+           for start in (None, -12, -3, 0, 1, 6, 9, 10, 12)
+           for stop in (None, -12, -3, 0, 1, 6, 9, 10, 12)
+           for step in (None, 1, 2, 3, -1, -2, -3) ]
+
+
+@pytest.mark.parametrize("key", slices, ids=str)
+def test_forward_slice(key):
+    array = np.arange(10)
+    start, stop, step = forward_slice(key, len(array))
+    assert 0 <= start <= stop <= len(array)
+    np.testing.assert_array_equal(array[start:stop][::step], array[key])
+
+
+@pytest.mark.parametrize("key", slices, ids=str)
+def test_slices(view, key):
+    result = view[key]
+    np.testing.assert_array_equal(result, view.array[key])
+    assert result.dtype == view.array.dtype
+    assert result.shape == view.array[key].shape
+
+
+def test_negative_steps(view):
+    np.testing.assert_array_equal(view[::-1], view.array[::-1])
+    np.testing.assert_array_equal(view[6:1:-2], view.array[[6, 4, 2]])
+
+
+def test_integers_and_tuples(view):
+    for i in range(-10, 10):
+        np.testing.assert_array_equal(view[i], view.array[i])
+    np.testing.assert_array_equal(view[8:2:-3, 1], view.array[8:2:-3, 1])
+    np.testing.assert_array_equal(view[4, 1], view.array[4, 1])
+    np.testing.assert_array_equal(np.asarray(view), view.array)
+    with pytest.raises(IndexError):
+        view[10]
+    with pytest.raises(IndexError):
+        view[-11]
@@ -79,7 +79,59 @@ def set_layer(obj, layer_idx):
     obj.layers[i] = (i == layer_idx)
 
 
-def add_object(object_dir, name, scale, loc, theta=0):
+def link_object(obj):
+  """ Link an object to the current scene """
+  if bpy.app.version < (2, 80, 0):
+    bpy.context.scene.objects.link(obj)
+  else:
+    bpy.context.collection.objects.link(obj)
+
+
+def unlink_object(obj):
+  """ Unlink an object from the scene, keeping it in bpy.data """
+  if bpy.app.version < (2, 80, 0):
+    bpy.context.scene.objects.unlink(obj)
+  else:
+    for collection in obj.users_collection:
+      collection.objects.unlink(obj)
+
+
+class ShapeCache(object):
+  """
+  Appends the .blend file of each shape once, and returns linked duplicates of it,
+  which share its mesh. The appended objects (the templates) are kept out of the scene.
+  Since the mesh is shared, the material of each duplicate is stored in an object-linked slot
+  (see add_material).
+
+  The cache is valid as long as the same file is open; reset() must be called when
+  the duplicates are removed so that the names are reused.
+  """
+  def __init__(self):
+    self.templates = {} # shape name -> the appended object
+    self.counts    = {} # shape name -> the number of duplicates
+
+  def reset(self):
+    self.counts.clear()
+
+  def add(self, object_dir, name):
+    if name not in self.templates:
+      filename = os.path.join(object_dir, '%s.blend' % name, 'Object', name)
+      bpy.ops.wm.append(filename=filename)
+      template = bpy.data.objects[name]
+      unlink_object(template)
+      template.data.materials.append(None)
+      self.templates[name] = template
+
+    count = self.counts.get(name, 0)
+    self.counts[name] = count + 1
+    o = self.templates[name].copy()
+    o.name = '%s_%d' % (name, count)
+    o.material_slots[0].link = 'OBJECT'
+    link_object(o)
+    return o
+
+
+def add_object(object_dir, name, scale, loc, theta=0, shapes=None):
   """
   Load an object from a file. We assume that in the directory object_dir, there
   is a file named "$name.blend" which contains a single object named "$name"
@@ -88,23 +140,28 @@ def add_object(object_dir, name, scale, loc, theta=0):
   - scale: scalar giving the size that the object should be in the scene
   - loc: tuple (x, y) giving the coordinates on the ground plane where the
     object should be placed.
+  - shapes: a ShapeCache. When given, the object is a linked duplicate of the cached one,
+    and it is transformed directly rather than by operators.
   """
-  # First figure out how many of this object are already in the scene so we can
-  # give the new object a unique name
-  count = 0
-  for obj in bpy.data.objects:
-    if obj.name.startswith(name):
-      count += 1
+  if shapes is not None:
+    o = shapes.add(object_dir, name)
+  else:
+    # First figure out how many of this object are already in the scene so we can
+    # give the new object a unique name
+    count = 0
+    for obj in bpy.data.objects:
+      if obj.name.startswith(name):
+        count += 1
 
-  filename = os.path.join(object_dir, '%s.blend' % name, 'Object', name)
-  bpy.ops.wm.append(filename=filename)
+    filename = os.path.join(object_dir, '%s.blend' % name, 'Object', name)
+    bpy.ops.wm.append(filename=filename)
 
-  # Give it a new name to avoid conflicts
-  new_name = '%s_%d' % (name, count)
-  bpy.data.objects[name].name = new_name
+    # Give it a new name to avoid conflicts
+    new_name = '%s_%d' % (name, count)
+    bpy.data.objects[name].name = new_name
+    o = bpy.data.objects[new_name]
 
   # Set the new object as active, then rotate, scale, and translate it
-  o = bpy.data.objects[new_name]
   if bpy.app.version < (2, 80, 0):
     bpy.context.scene.objects.active = o
   else:
@@ -112,9 +169,18 @@ def add_object(object_dir, name, scale, loc, theta=0):
     bpy.context.view_layer.objects.active = o
 
   bpy.context.object.rotation_euler[2] = theta
-  bpy.ops.transform.resize(value=(scale, scale, scale))
-  # modified from CLEVR: y-axis is 0, and blocks are stacked vertically
-  bpy.ops.transform.translate(value=tuple(loc))
+  if shapes is not None:
+    o.scale    = [ s * scale for s in o.scale ]
+    o.location = [ l + d for l, d in zip(o.location, loc) ]
+    # update the world matrix, which the dimensions depend on
+    if bpy.app.version < (2, 80, 0):
+      bpy.context.scene.update()
+    else:
+      bpy.context.view_layer.update()
+  else:
+    bpy.ops.transform.resize(value=(scale, scale, scale))
+    # modified from CLEVR: y-axis is 0, and blocks are stacked vertically
+    bpy.ops.transform.translate(value=tuple(loc))
 
 
 def load_materials(material_dir):
@@ -130,38 +196,15 @@ def load_materials(material_dir):
     bpy.ops.wm.append(filename=filepath)
 
 
-def add_material(name, **properties):
+def new_material(name, mat_name, **properties):
   """
-  Create a new material and assign it to the active object. "name" should be the
-  name of a material that has been previously loaded using load_materials.
+  Create a new material called mat_name from the node group "name", loaded by load_materials,
+  through the datablock API. properties are the values of the inputs of the group node, e.g., Color.
   """
-  # Figure out how many materials are already in the scene
-  mat_count = len(bpy.data.materials)
+  mat = bpy.data.materials.new(mat_name)
+  mat.use_nodes = True
 
-  # Create a new material; it is not attached to anything and
-  # it will be called "Material"
-  bpy.ops.material.new()
-
-  # Get a reference to the material we just created and rename it;
-  # then the next time we make a new material it will still be called
-  # "Material" and we will still be able to look it up by name
-  mat = bpy.data.materials['Material']
-  mat.name = 'Material_%d' % mat_count
-
-  # Attach the new material to the active object
-  # Make sure it doesn't already have materials
-  obj = bpy.context.active_object
-  assert len(obj.data.materials) == 0
-  obj.data.materials.append(mat)
-
-  # Find the output node of the new material
-  output_node = None
-  for n in mat.node_tree.nodes:
-    if n.name == 'Material Output':
-      output_node = n
-      break
-
-  # Add a new GroupNode to the node tree of the active material,
+  # Add a new GroupNode to the node tree of the new material,
   # and copy the node tree from the preloaded node group to the
   # new group node. This copying seems to happen by-value, so
   # we can create multiple materials of the same type without them
@@ -178,6 +221,48 @@ def add_material(name, **properties):
   # the MaterialOutput node
   mat.node_tree.links.new(
       group_node.outputs['Shader'],
-      output_node.inputs['Surface'],
+      mat.node_tree.nodes['Material Output'].inputs['Surface'],
   )
+  return mat
+
+
+class MaterialCache(object):
+  """
+  Builds a material for each node group and input values (e.g., the RGBA of Color) once,
+  and reuses it for all objects with the same ones.
 
+  The cache is valid as long as the same file is open.
+  """
+  def __init__(self):
+    self.materials = {} # (name, properties) -> material
+
+  def get(self, name, **properties):
+    key = (name, tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple)) else v)
+                              for k, v in properties.items())))
+    if key not in self.materials:
+      self.materials[key] = new_material(name, 'Material_%s_%d' % (name, len(self.materials)), **properties)
+    return self.materials[key]
+
+
+def add_material(name, materials=None, **properties):
+  """
+  Create a new material and assign it to the active object. "name" should be the
+  name of a material that has been previously loaded using load_materials.
+  materials is an optional MaterialCache, from which the material is reused if it was already built.
+  """
+  if materials is not None:
+    mat = materials.get(name, **properties)
+  else:
+    # Name it after the number of materials already in the scene
+    mat = new_material(name, 'Material_%d' % len(bpy.data.materials), **properties)
+
+  # Attach the new material to the active object
+  # Make sure it doesn't already have materials
+  obj = bpy.context.active_object
+  if len(obj.material_slots) > 0 and obj.material_slots[0].link == 'OBJECT':
+    # a linked duplicate made by ShapeCache, whose mesh is shared
+    assert obj.material_slots[0].material is None
+    obj.material_slots[0].material = mat
+  else:
+    assert len(obj.data.materials) == 0
+    obj.data.materials.append(mat)
@@ -0,0 +1,53 @@
+"""
+A base class of the read-only views of an array that is stored in several parts along the first axis,
+e.g., the chunks of a ChunkedStore (chunked_store.py) or the shards of a ShardedDataset (sharded_dataset.py).
+
+A subclass sets dtype and shape and implements _rows(start, stop), which returns the rows in [start, stop)
+for 0 <= start < stop <= len(self), and _row(i), which returns the i-th row for 0 <= i < len(self).
+RowView supports len(), np.asarray(), and indexing by an int, a slice with any step, or a tuple
+whose first element is one of them, in the same way as a numpy array.
+"""
+
+import numpy as np
+
+
+def forward_slice(key, length):
+    """Returns (start, stop, step) such that array[key] is array[start:stop][::step] for an array of the length,
+where 0 <= start <= stop <= length. A slice with a negative step is turned into the forward range of the same rows."""
+    start, stop, step = key.indices(length)
+    if step > 0:
+        return start, max(start, stop), step
+    if stop >= start:
+        # empty. start is -1 when the slice starts before the first row
+        return 0, 0, step
+    # the rows from start down to stop+1. [::step] of them starts from the last one, i.e., start
+    return stop + 1, start + 1, step
+
+
+class RowView(object):
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[:]
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self[key[0]][(slice(None), *key[1:]) if isinstance(key[0], slice) else key[1:]]
+        if isinstance(key, slice):
+            start, stop, step = forward_slice(key, len(self))
+            if stop <= start:
+                rows = np.zeros((0, *self.shape[1:]), dtype=self.dtype)
+            else:
+                rows = self._rows(start, stop)
+            return rows if step == 1 else rows[::step]
+        key = int(key)
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("index {} is out of bounds for {} with length {}".format(key, self.name, len(self)))
+        return self._row(key)